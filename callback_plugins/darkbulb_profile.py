@@ -0,0 +1,296 @@
+# (c) 2018, Victor da Costa <victorockeiro@gmail.com>
+#
+# This file is part of Ansible
+#
+# Ansible is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Ansible is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Ansible.  If not, see <http://www.gnu.org/licenses/>.
+
+# Make coding more python3-ish
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+DOCUMENTATION = '''
+    callback: darkbulb_profile
+    type: aggregate
+    short_description: Profile of the topology bring-up
+    description:
+      - Records the duration of every task and host, the renders of the
+        to_xml and topology_to_xml filters (documents, cache hits, bytes
+        and seconds per kind and per document) and the libvirt calls
+        made by virt_topology for every object (define, create,
+        autostart, qemu-img...).
+      - At the end of the playbook, writes them as JSON to
+        C(<profile_path>.json), with the totals of every phase, and as
+        folded stacks to C(<profile_path>.folded), the input of
+        flamegraph.pl or speedscope.
+      - Filters run in the worker processes, they append their timings to
+        C(<profile_path>.spool), which is removed once read.
+    requirements:
+      - enable in configuration
+    options:
+      profile_path:
+        description: Path of the profile, without extension.
+        default: ~/.ansible/darkbulb-profile
+        env:
+          - name: DARKBULB_PROFILE
+        ini:
+          - section: callback_darkbulb_profile
+            key: profile_path
+'''
+
+import bisect
+import json
+import os
+import time
+
+from ansible.module_utils._text import to_bytes, to_text
+from ansible.plugins.callback import CallbackBase
+
+# Environment variable the filters of filter_plugins/xml.py read the spool
+# path from, see PROFILE_SPOOL there
+PROFILE_SPOOL = 'DARKBULB_PROFILE_SPOOL'
+
+# Modules whose results list the objects they provisioned
+OBJECT_MODULES = ('virt_topology',)
+
+
+def _frame(name):
+    '''Folded stacks separate frames with ";" and end with the value'''
+    return to_text(name).replace(';', ':').replace('\n', ' ').strip() or '-'
+
+
+def _add(totals, key, seconds, **counters):
+    phase = totals.setdefault(key, dict((name, 0) for name in counters))
+    phase.setdefault('seconds', 0.0)
+    phase['seconds'] += seconds
+    for name, value in counters.items():
+        phase[name] = phase.get(name, 0) + value
+
+
+class CallbackModule(CallbackBase):
+    CALLBACK_VERSION = 2.0
+    CALLBACK_TYPE = 'aggregate'
+    CALLBACK_NAME = 'darkbulb_profile'
+    CALLBACK_NEEDS_WHITELIST = True
+    CALLBACK_NEEDS_ENABLED = True
+
+    def __init__(self, display=None):
+        super(CallbackModule, self).__init__(display=display)
+        self.profile_path = None
+        self.spool = None
+        self.started = None
+        self.play = None
+        self.tasks = []
+        self.current = None
+        self.objects = []
+
+    def set_options(self, task_keys=None, var_options=None, direct=None):
+        super(CallbackModule, self).set_options(task_keys=task_keys,
+                                                var_options=var_options, direct=direct)
+        self.profile_path = os.path.abspath(os.path.expanduser(self.get_option('profile_path')))
+
+    def v2_playbook_on_start(self, playbook):
+        if self.profile_path is None:
+            self.set_options()
+        self.started = time.time()
+        self.spool = self.profile_path + '.spool'
+        directory = os.path.dirname(self.spool)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        open(self.spool, 'wb').close()
+        # Inherited by the worker processes, forked after this point
+        os.environ[PROFILE_SPOOL] = self.spool
+
+    def v2_playbook_on_play_start(self, play):
+        self._end_task()
+        self.play = play.get_name().strip() or 'play'
+
+    def _start_task(self, task):
+        self._end_task()
+        self.current = {
+            'play': self.play,
+            'task': task.get_name().strip(),
+            'action': task.action,
+            'started': time.time(),
+            'hosts': {},
+        }
+        self.tasks.append(self.current)
+
+    def _end_task(self):
+        if self.current is not None:
+            self.current['seconds'] = time.time() - self.current['started']
+            self.current = None
+
+    def v2_playbook_on_task_start(self, task, is_conditional):
+        self._start_task(task)
+
+    def v2_playbook_on_handler_task_start(self, task):
+        self._start_task(task)
+
+    def _host_done(self, result):
+        if self.current is None:
+            return
+        host = result._host.get_name()
+        self.current['hosts'][host] = time.time() - self.current['started']
+        if result._task.action.split('.')[-1] not in OBJECT_MODULES:
+            return
+        for item in result._result.get('results') or []:
+            if not isinstance(item, dict) or 'kind' not in item:
+                continue
+            self.objects.append({
+                'play': self.current['play'],
+                'task': self.current['task'],
+                'module': result._task.action.split('.')[-1],
+                'host': host,
+                'kind': to_text(item['kind']),
+                'key': to_text(item.get('key')),
+                'actions': [to_text(action) for action in item.get('actions') or []],
+                'timings': dict((to_text(action), float(seconds)) for action, seconds
+                                in (item.get('timings') or {}).items()),
+                'started': float(item.get('started') or 0),
+                'elapsed': float(item.get('elapsed') or 0),
+                'failed': bool(item.get('failed')),
+            })
+
+    def v2_runner_on_ok(self, result):
+        self._host_done(result)
+
+    def v2_runner_on_failed(self, result, ignore_errors=False):
+        self._host_done(result)
+
+    def v2_runner_on_skipped(self, result):
+        self._host_done(result)
+
+    def v2_runner_on_unreachable(self, result):
+        self._host_done(result)
+
+    def _read_spool(self):
+        '''Filter records of the spool, oldest first'''
+        records = []
+        try:
+            with open(self.spool, 'rb') as spool:
+                for line in spool:
+                    try:
+                        records.append(json.loads(to_text(line)))
+                    except ValueError:
+                        # Line cut short by a worker killed while writing
+                        continue
+            os.unlink(self.spool)
+        except (IOError, OSError):
+            pass
+        records.sort(key=lambda record: record['start'])
+        return records
+
+    def _task_of(self, starts, when):
+        '''Task running when a filter record started'''
+        index = bisect.bisect_right(starts, when) - 1
+        return self.tasks[index] if index >= 0 else {'play': self.play or 'play',
+                                                     'task': '(playbook)'}
+
+    def v2_playbook_on_stats(self, stats):
+        self._end_task()
+        os.environ.pop(PROFILE_SPOOL, None)
+        if self.started is None:
+            return
+
+        starts = [task['started'] for task in self.tasks]
+        phases = {}
+        filters = {}
+        renders = []
+        folded = {}
+        nested = {}
+
+        def fold(frames, seconds):
+            stack = ';'.join(_frame(frame) for frame in frames)
+            folded[stack] = folded.get(stack, 0) + seconds
+
+        for record in self._read_spool():
+            task = self._task_of(starts, record['start'])
+            frames = [task['play'], task['task'], record['filter']]
+            nested[id(task)] = nested.get(id(task), 0) + record['seconds']
+            summary = filters.setdefault(record['filter'], {'calls': 0, 'seconds': 0.0, 'kinds': {}})
+            summary['calls'] += 1
+            summary['seconds'] += record['seconds']
+            rendered = 0.0
+            for kind, counters in record['kinds'].items():
+                _add(summary['kinds'], kind, counters['seconds'], count=counters['count'],
+                     cached=counters['cached'], bytes=counters['bytes'])
+                _add(phases, 'render/%s' % kind, counters['seconds'], count=counters['count'],
+                     cached=counters['cached'], bytes=counters['bytes'])
+                rendered += counters['seconds']
+            for kind, name, seconds, size in record['objects']:
+                renders.append({'play': task['play'], 'task': task['task'],
+                                'filter': record['filter'], 'kind': kind, 'name': name,
+                                'seconds': seconds, 'bytes': size})
+                fold(frames + [kind, name], seconds)
+            if not record['objects']:
+                # to_xml renders one document, named after its root element
+                for kind, counters in record['kinds'].items():
+                    fold(frames + [kind], counters['seconds'])
+                rendered = record['seconds']
+            fold(frames + ['hash'], record.get('hash_seconds', max(0, record['seconds'] - rendered)))
+
+        by_name = dict(((task['play'], task['task']), task) for task in self.tasks)
+        for item in self.objects:
+            frames = [item['play'], item['task'], item['module'], item['host'],
+                      item['kind'], item['key']]
+            other = item['elapsed']
+            for action, seconds in item['timings'].items():
+                _add(phases, 'provision/%s/%s' % (item['kind'], action), seconds, count=1)
+                fold(frames + [action], seconds)
+                other -= seconds
+            # Lookups and definition comparisons
+            fold(frames + ['other'], max(0, other))
+            _add(phases, 'provision/%s' % item['kind'], item['elapsed'], count=1)
+            task = by_name.get((item['play'], item['task']))
+            if task is not None:
+                nested[id(task)] = nested.get(id(task), 0) + item['elapsed']
+
+        for task in self.tasks:
+            fold([task['play'], task['task']], max(0, task['seconds'] - nested.get(id(task), 0)))
+
+        profile = {
+            'started': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(self.started)),
+            'seconds': round(time.time() - self.started, 6),
+            'tasks': [{
+                'play': task['play'],
+                'task': task['task'],
+                'action': task['action'],
+                'started': round(task['started'] - self.started, 6),
+                'seconds': round(task['seconds'], 6),
+                'hosts': dict((host, round(seconds, 6)) for host, seconds in task['hosts'].items()),
+            } for task in self.tasks],
+            'phases': phases,
+            'filters': filters,
+            'renders': renders,
+            'objects': self.objects,
+        }
+        for totals in [phases] + [summary['kinds'] for summary in filters.values()]:
+            for phase in totals.values():
+                phase['seconds'] = round(phase['seconds'], 6)
+        for summary in filters.values():
+            summary['seconds'] = round(summary['seconds'], 6)
+
+        with open(self.profile_path + '.json', 'wb') as output:
+            output.write(to_bytes(json.dumps(profile, indent=2, sort_keys=True) + '\n'))
+        with open(self.profile_path + '.folded', 'wb') as output:
+            for stack in sorted(folded):
+                # Flamegraph samples are integers: microseconds
+                microseconds = int(round(folded[stack] * 1000000))
+                if microseconds > 0:
+                    output.write(to_bytes('%s %d\n' % (stack, microseconds)))
+
+        self._display.display('darkbulb_profile: %d tasks, %d documents rendered, %d objects '
+                              'provisioned in %.1fs, see %s.json and %s.folded'
+                              % (len(self.tasks), len(renders), len(self.objects),
+                                 profile['seconds'], self.profile_path, self.profile_path))
@@ -0,0 +1,568 @@
+# (c) 2018, Victor da Costa <victorockeiro@gmail.com>
+#
+# This file is part of Ansible
+#
+# Ansible is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Ansible is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Ansible.  If not, see <http://www.gnu.org/licenses/>.
+
+# Make coding more python3-ish
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import itertools
+import math
+import re
+
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+from ansible.errors import AnsibleFilterError
+from ansible.module_utils.six import string_types
+
+RANGE = re.compile(r'\[(\d+):(\d+)\]')
+PLACEHOLDER = re.compile(r'\{(\w+)\}')
+
+# Interface used for point-to-point links when the template has none
+LINK_INTERFACE = {'@type': 'udp', 'model': {'@type': 'e1000'}}
+
+# Locally administered prefix of the MAC addresses given to link interfaces
+LINK_MAC_PREFIX = '52:54:01'
+MAX_PORT = 65535
+
+# Bytes per libvirt memory unit, KiB when the unit is missing
+MEMORY_UNITS = {'b': 1, 'bytes': 1,
+                'kb': 10 ** 3, 'k': 2 ** 10, 'kib': 2 ** 10,
+                'mb': 10 ** 6, 'm': 2 ** 20, 'mib': 2 ** 20,
+                'gb': 10 ** 9, 'g': 2 ** 30, 'gib': 2 ** 30,
+                'tb': 10 ** 12, 't': 2 ** 40, 'tib': 2 ** 40}
+
+
+def _expand(pattern):
+    '''Expand a range pattern into (name, index) pairs, index being the
+    range values of the name joined with "-"'''
+    parts = RANGE.split(pattern)
+    literals = parts[0::3]
+    ranges = []
+    for low, high in zip(parts[1::3], parts[2::3]):
+        width = len(low) if low.startswith('0') else 0
+        ranges.append(['%0*d' % (width, i) for i in range(int(low), int(high) + 1)])
+    expanded = []
+    for combination in itertools.product(*ranges):
+        name = literals[0]
+        for value, literal in zip(combination, literals[1:]):
+            name += value + literal
+        expanded.append((name, '-'.join(combination)))
+    return expanded
+
+
+def expand_range(pattern):
+    '''Expand "leaf[01:04]" into ["leaf01", ..., "leaf04"]
+
+    Zero padding of the lower bound is kept, several ranges in the same
+    pattern expand to their cartesian product.'''
+    return [name for name, index in _expand(pattern)]
+
+
+def _substitute(data, context):
+    '''Deep copy data replacing {placeholder} with values from context'''
+    if isinstance(data, dict):
+        return dict((key, _substitute(value, context)) for key, value in data.items())
+    if isinstance(data, list):
+        return [_substitute(value, context) for value in data]
+    if isinstance(data, string_types) and '{' in data:
+        return PLACEHOLDER.sub(lambda m: str(context.get(m.group(1), m.group(0))), data)
+    return data
+
+
+def _endpoints(pattern):
+    '''Expand a "node:interface" endpoint pattern into (node, interface) pairs'''
+    endpoints = []
+    for endpoint in expand_range(pattern):
+        node, sep, interface = endpoint.rpartition(':')
+        if not sep:
+            raise AnsibleFilterError('Link endpoint %s is not in the node:interface '
+                                     'form' % endpoint)
+        endpoints.append((node, interface))
+    return endpoints
+
+
+def expand_links(links):
+    '''Expand a link list into [(a, b, ports)] with a and b (node, interface)
+
+    A link is either a pair of endpoint patterns or a dict with `endpoints`
+    and an optional `ports` pair (local UDP port of each side). Both sides
+    of a pattern must expand to the same number of endpoints.'''
+    expanded = []
+    for link in links or []:
+        ports = None
+        if isinstance(link, Mapping):
+            ports = link.get('ports')
+            link = link.get('endpoints', [])
+        if len(link) != 2:
+            raise AnsibleFilterError('Link %s must have exactly two endpoints' % (link,))
+        side_a, side_b = _endpoints(link[0]), _endpoints(link[1])
+        if len(side_a) != len(side_b):
+            raise AnsibleFilterError('Link %s - %s expands to %d and %d endpoints' % (
+                link[0], link[1], len(side_a), len(side_b)))
+        if ports and len(side_a) != 1:
+            raise AnsibleFilterError('Ports can only be set on single links, '
+                                     'not on %s - %s' % (link[0], link[1]))
+        for a, b in zip(side_a, side_b):
+            expanded.append((a, b, ports))
+    return expanded
+
+
+class Allocator(object):
+    '''Deterministic allocator of UDP ports and MAC addresses
+
+    Ports are handed out sequentially from port_base, skipping reserved
+    ports and ports claimed explicitly. MAC addresses are the prefix followed
+    by a 24 bits counter.'''
+
+    def __init__(self, port_base=10000, reserved=None, mac_prefix=LINK_MAC_PREFIX):
+        self.port = int(port_base)
+        self.used = set()
+        for port in reserved or []:
+            if isinstance(port, string_types) and '-' in port:
+                low, high = port.split('-', 1)
+                self.used.update(range(int(low), int(high) + 1))
+            else:
+                self.used.add(int(port))
+        self.mac_prefix = mac_prefix
+        self.mac = 0
+
+    def claim(self, port, owner):
+        port = int(port)
+        if port in self.used:
+            raise AnsibleFilterError('Port %d of %s is reserved or already '
+                                     'in use' % (port, owner))
+        self.used.add(port)
+        return port
+
+    def next_port(self):
+        while self.port in self.used:
+            self.port += 1
+        if self.port > MAX_PORT:
+            raise AnsibleFilterError('No UDP port left to allocate')
+        self.used.add(self.port)
+        return self.port
+
+    def next_mac(self):
+        self.mac += 1
+        if self.mac > 0xffffff:
+            raise AnsibleFilterError('No MAC address left under %s' % self.mac_prefix)
+        return '%s:%02x:%02x:%02x' % (self.mac_prefix, self.mac >> 16,
+                                      (self.mac >> 8) & 0xff, self.mac & 0xff)
+
+
+def _allocate(links, allocator):
+    '''Yield (a, b, port_a, port_b, mac_a, mac_b) for expanded links
+
+    Explicit ports are claimed before any port is allocated, so sequential
+    ports never collide with them, whatever the order of the links.'''
+    explicit = {}
+    for position, (a, b, ports) in enumerate(links):
+        if ports:
+            explicit[position] = (allocator.claim(ports[0], '%s:%s' % a),
+                                  allocator.claim(ports[1], '%s:%s' % b))
+    for position, (a, b, ports) in enumerate(links):
+        port_a, port_b = explicit.get(position) or (allocator.next_port(),
+                                                    allocator.next_port())
+        yield a, b, port_a, port_b, allocator.next_mac(), allocator.next_mac()
+
+
+def allocate_links(links, port_base=10000, reserved=None, mac_prefix=LINK_MAC_PREFIX):
+    '''Assign local UDP ports and MAC addresses to both ends of every link
+
+    Returns a list of {endpoints, ports, macs} with the expanded endpoints
+    in the "node:interface" form. The result only depends on the order of
+    the links.'''
+    allocator = Allocator(port_base, reserved, mac_prefix)
+    return [{'endpoints': ['%s:%s' % a, '%s:%s' % b],
+             'ports': [port_a, port_b],
+             'macs': [mac_a, mac_b]}
+            for a, b, port_a, port_b, mac_a, mac_b
+            in _allocate(expand_links(links), allocator)]
+
+
+def _interfaces(document):
+    devices = (document.get('domain') or {}).get('devices') or {}
+    interfaces = devices.get('interface') or []
+    if not isinstance(interfaces, list):
+        interfaces = [interfaces]
+    return interfaces
+
+
+def validate_topology(topology):
+    '''Look for duplicate UDP ports, MAC addresses and interface target
+    devices, and broken links
+
+    A single pass over the domain interfaces indexes MAC addresses and local
+    UDP endpoints by value, links are then checked with one lookup each.
+    Returns {errors, warnings, interfaces}. A link whose remote endpoint no
+    interface listens on is only a warning, it may reach outside of the
+    topology.'''
+    macs = {}
+    listeners = {}
+    links = []
+    errors = []
+    count = 0
+    for name, document in (topology.get('domains') or {}).items():
+        devices = set()
+        for position, interface in enumerate(_interfaces(document)):
+            count += 1
+            device = (interface.get('target') or {}).get('@dev')
+            owner = '%s:%s' % (name, position if device is None else device)
+            if device is not None:
+                if device in devices:
+                    errors.append('%s is the target device of more than one interface' % owner)
+                devices.add(device)
+
+            mac = (interface.get('mac') or {}).get('@address')
+            if mac:
+                mac = mac.lower()
+                if mac in macs:
+                    errors.append('%s uses MAC %s already used by %s' % (owner, mac, macs[mac]))
+                else:
+                    macs[mac] = owner
+
+            if interface.get('@type') != 'udp':
+                continue
+            source = interface.get('source') or {}
+            local = source.get('local') or {}
+            if not source.get('@port') or not local.get('@port'):
+                errors.append('%s is an udp interface without local and remote '
+                              'ports' % owner)
+                continue
+            local = (local.get('@address'), str(local['@port']))
+            remote = (source.get('@address'), str(source['@port']))
+            if local in listeners:
+                errors.append('%s listens on %s:%s already used by %s' % (
+                    (owner,) + local + (listeners[local][0],)))
+                continue
+            listeners[local] = (owner, remote)
+            links.append((owner, local, remote))
+
+    warnings = []
+    for owner, local, remote in links:
+        peer = listeners.get(remote)
+        if peer is None:
+            warnings.append('%s sends to %s:%s where no interface listens' % ((owner,) + remote))
+        elif peer[1] != local:
+            errors.append('%s sends to %s which sends to %s:%s instead' % (
+                (owner, peer[0]) + peer[1]))
+    return {'errors': errors, 'warnings': warnings, 'interfaces': count}
+
+
+def _scalar(element):
+    '''Value and unit of an element, text or {$, @unit}'''
+    if isinstance(element, Mapping):
+        return element.get('$'), element.get('@unit')
+    return element, None
+
+
+def domain_demand(document):
+    '''Memory (MiB, rounded up) and vCPUs of a domain document'''
+    domain = document.get('domain') or {}
+    memory, unit = _scalar(domain.get('memory'))
+    if memory is None:
+        raise AnsibleFilterError('Domain %s has no memory' % domain.get('name'))
+    unit = (unit or 'KiB').lower()
+    if unit not in MEMORY_UNITS:
+        raise AnsibleFilterError('Domain %s uses unknown memory unit %s' % (
+            domain.get('name'), unit))
+    vcpu = _scalar(domain.get('vcpu'))[0]
+    return (int(math.ceil(int(memory) * MEMORY_UNITS[unit] / 2.0 ** 20)),
+            int(vcpu or 1))
+
+
+def _udp_interfaces(domains):
+    '''(name, position, peer) of the udp interfaces of domains, peer being
+    the domain listening on their remote endpoint, None if there is none'''
+    listeners = {}
+    interfaces = []
+    for name in sorted(domains):
+        for position, interface in enumerate(_interfaces(domains[name])):
+            source = interface.get('source') or {}
+            local = source.get('local') or {}
+            if interface.get('@type') != 'udp' or not local.get('@port'):
+                continue
+            listeners[(local.get('@address'), str(local['@port']))] = name
+            interfaces.append((name, position, (source.get('@address'), str(source.get('@port')))))
+    return [(name, position, listeners.get(remote)) for name, position, remote in interfaces]
+
+
+def _disk_files(document):
+    devices = (document.get('domain') or {}).get('devices') or {}
+    disks = devices.get('disk') or []
+    if not isinstance(disks, list):
+        disks = [disks]
+    return [((disk.get('source') or {}).get('@file') or '').rpartition('/')[2] for disk in disks]
+
+
+def _copy(data):
+    '''Copy the dicts and lists of data, sharing the values. Cheaper than
+    copy.deepcopy on the templated containers given to filters'''
+    if isinstance(data, Mapping):
+        return dict((key, _copy(value)) for key, value in data.items())
+    if isinstance(data, list):
+        return [_copy(value) for value in data]
+    return data
+
+
+def _copy_interfaces(document):
+    '''Copy of a domain document sharing everything but its interfaces'''
+    document = dict(document)
+    domain = document['domain'] = dict(document['domain'])
+    devices = domain['devices'] = dict(domain['devices'])
+    devices['interface'] = _copy(devices['interface'])
+    return document
+
+
+def place_topology(topology, hosts):
+    '''Place the domains of topology on hypervisors and split it per host
+
+    hosts maps hypervisor names to their capacity and link address:
+    {name: {memory (MiB), vcpu, address}}. Domains are bin-packed by memory
+    and vCPU, first fit in host name order. They are taken link by link,
+    breadth first from the largest domain, and each one goes to the host
+    holding most of its link peers already, so that linked domains share a
+    host as long as it has room.
+
+    The UDP interfaces of links crossing hosts are rewritten: they listen
+    on the address of their host and send to the address of the peer host.
+    Volumes follow the domain of the same name, or using them as disk.
+    Returns {placement, hosts, topologies, cross_host_links}, topologies
+    being the sub-topology of every host.'''
+    domains = topology.get('domains') or {}
+    names = sorted(hosts)
+    rank = dict((host, index) for index, host in enumerate(names))
+    if not names:
+        raise AnsibleFilterError('No hypervisor to place the topology on')
+    free = dict((host, [int(hosts[host].get('memory') or 0), int(hosts[host].get('vcpu') or 0)])
+                for host in names)
+    address = dict((host, hosts[host].get('address') or host) for host in names)
+    demand = dict((name, domain_demand(document)) for name, document in domains.items())
+
+    udp = _udp_interfaces(domains)
+    weights = dict((name, {}) for name in domains)
+    for name, position, peer in udp:
+        if peer is not None and peer != name:
+            weights[name][peer] = weights[name].get(peer, 0) + 1
+
+    # Breadth first over the links, largest domains first
+    order = []
+    seen = set()
+    for root in sorted(domains, key=lambda name: (-demand[name][0], -demand[name][1], name)):
+        if root in seen:
+            continue
+        seen.add(root)
+        queue = [root]
+        while queue:
+            name = queue.pop(0)
+            order.append(name)
+            for peer in sorted(weights[name], key=lambda peer: (-weights[name][peer],
+                                                                  -demand[peer][0], peer)):
+                if peer not in seen:
+                    seen.add(peer)
+                    queue.append(peer)
+
+    placement = {}
+    for name in order:
+        memory, vcpu = demand[name]
+        fits = [host for host in names if free[host][0] >= memory and free[host][1] >= vcpu]
+        if not fits:
+            raise AnsibleFilterError('No hypervisor has %d MiB and %d vCPU left for domain %s' % (
+                memory, vcpu, name))
+        affinity = dict((host, 0) for host in fits)
+        for peer, weight in weights[name].items():
+            if placement.get(peer) in affinity:
+                affinity[placement[peer]] += weight
+        host = max(fits, key=lambda host: (affinity[host], -rank[host]))
+        placement[name] = host
+        free[host][0] -= memory
+        free[host][1] -= vcpu
+
+    # Links crossing hosts use the host addresses instead of loopback
+    documents = dict(domains.items())
+    cross = 0
+    for name, position, peer in udp:
+        if peer is None or placement[peer] == placement[name]:
+            continue
+        cross += 1
+        if documents[name] is domains[name]:
+            documents[name] = _copy_interfaces(domains[name])
+        source = _interfaces(documents[name])[position]['source']
+        source['@address'] = address[placement[peer]]
+        source['local']['@address'] = address[placement[name]]
+
+    disks = {}
+    for name, document in domains.items():
+        for disk in _disk_files(document):
+            disks.setdefault(disk, name)
+    volumes = dict((host, {}) for host in names)
+    for key, document in (topology.get('volumes') or {}).items():
+        owner = key if key in placement else disks.get((document.get('volume') or {}).get('name'))
+        for host in [placement[owner]] if owner in placement else names:
+            volumes[host][key] = document
+
+    report = {}
+    topologies = {}
+    for host in names:
+        placed = sorted(name for name in placement if placement[name] == host)
+        report[host] = {'domains': placed,
+                        'memory': int(hosts[host].get('memory') or 0) - free[host][0],
+                        'vcpu': int(hosts[host].get('vcpu') or 0) - free[host][1],
+                        'memory_free': free[host][0],
+                        'vcpu_free': free[host][1]}
+        topologies[host] = dict(topology)
+        topologies[host]['domains'] = dict((name, documents[name]) for name in placed)
+        topologies[host]['volumes'] = volumes[host]
+    return {'placement': placement, 'hosts': report, 'topologies': topologies,
+            'cross_host_links': cross // 2}
+
+
+class LazyNodes(Mapping):
+    '''Read-only mapping generating the document of a node when accessed'''
+
+    def __init__(self, names, factory):
+        self._names = names
+        self._known = set(names)
+        self._factory = factory
+
+    def __getitem__(self, name):
+        if name not in self._known:
+            raise KeyError(name)
+        return self._factory(name)
+
+    def __iter__(self):
+        return iter(self._names)
+
+    def __len__(self):
+        return len(self._names)
+
+
+class TopologySpec(object):
+    '''Compact topology specification: node templates, ranges and links'''
+
+    def __init__(self, spec):
+        self.templates = spec.get('templates', {})
+        self.address = spec.get('link_address', '127.0.0.1')
+        self.allocator = Allocator(spec.get('link_port_base', 10000),
+                                   spec.get('link_reserved_ports'),
+                                   spec.get('link_mac_prefix', LINK_MAC_PREFIX))
+
+        defaults = spec.get('defaults', {})
+        self.nodes = {}
+        self.names = []
+        for pattern, node in (spec.get('nodes') or {}).items():
+            if isinstance(node, string_types):
+                node = {'template': node}
+            node = dict(defaults, **(node or {}))
+            if node.get('template') not in self.templates:
+                raise AnsibleFilterError('Node %s uses unknown template %s' % (
+                    pattern, node.get('template')))
+            for name, index in _expand(pattern):
+                context = {'name': name, 'index': index}
+                # Node variables may themselves use {name} and {index}
+                for key, value in (node.get('vars') or {}).items():
+                    context[key] = _substitute(value, {'name': name, 'index': index})
+                self.nodes[name] = (node['template'], context)
+                self.names.append(name)
+
+        self.interfaces = dict((name, []) for name in self.names)
+        self._assign_links(expand_links(spec.get('links')))
+
+    def _assign_links(self, links):
+        '''Give every link endpoint a local UDP port and a MAC address'''
+        used = set()
+        for a, b, ports in links:
+            for node, interface in (a, b):
+                if node not in self.interfaces:
+                    raise AnsibleFilterError('Link endpoint %s:%s refers to an '
+                                             'unknown node' % (node, interface))
+                if (node, interface) in used:
+                    raise AnsibleFilterError('Link endpoint %s:%s is used by more '
+                                             'than one link' % (node, interface))
+                used.add((node, interface))
+        for a, b, port_a, port_b, mac_a, mac_b in _allocate(links, self.allocator):
+            self.interfaces[a[0]].append((a[1], port_a, port_b, mac_a))
+            self.interfaces[b[0]].append((b[1], port_b, port_a, mac_b))
+
+    def domain(self, name):
+        template, context = self.nodes[name]
+        domain = _substitute(self.templates[template]['domain'], context)
+        devices = domain.setdefault('domain', {}).setdefault('devices', {})
+        interfaces = devices.get('interface', [])
+        if not isinstance(interfaces, list):
+            interfaces = [interfaces]
+        link_interface = self.templates[template].get('link_interface', LINK_INTERFACE)
+        for interface, local, remote, mac in sorted(self.interfaces[name]):
+            item = _substitute(link_interface, context)
+            item.setdefault('mac', {'@address': mac})
+            item['source'] = {'@address': self.address,
+                              '@port': str(remote),
+                              'local': {'@address': self.address,
+                                        '@port': str(local)}}
+            item['target'] = {'@dev': interface}
+            interfaces.append(item)
+        if interfaces:
+            devices['interface'] = interfaces
+        return domain
+
+    def volume(self, name):
+        template, context = self.nodes[name]
+        return _substitute(self.templates[template]['volume'], context)
+
+    def volume_names(self):
+        return [name for name in self.names
+                if 'volume' in self.templates[self.nodes[name][0]]]
+
+
+def expand_topology(spec=dict(), base=None, lazy=True):
+    '''Expand a compact topology specification into the topology structure
+
+    The config, networks and pools sections come from base and the spec,
+    domains and volumes are generated from the node templates and links.
+    With lazy=True, domains and volumes are read-only mappings building each
+    node document when it is accessed; lazy=False returns plain dicts.'''
+    nodes = TopologySpec(spec)
+
+    topology = dict(base or {})
+    for section in ('config', 'networks', 'pools'):
+        if section in spec:
+            topology[section] = spec[section]
+
+    domains = LazyNodes(nodes.names, nodes.domain)
+    volumes = LazyNodes(nodes.volume_names(), nodes.volume)
+    if not lazy:
+        domains, volumes = dict(domains.items()), dict(volumes.items())
+    topology['domains'] = domains
+    topology['volumes'] = volumes
+    return topology
+
+
+class FilterModule(object):
+    """Filters for topology specifications"""
+
+    filter_map = {
+        'allocate_links': allocate_links,
+        'expand_topology': expand_topology,
+        'place_topology': place_topology,
+        'validate_topology': validate_topology,
+    }
+
+    def filters(self):
+        return self.filter_map
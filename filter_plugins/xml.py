@@ -19,29 +19,667 @@
 from __future__ import (absolute_import, division, print_function)
 __metaclass__ = type
 
-from xmltodict import unparse as XMLDecoder
-from xmltodict import parse as XMLEncoder
+import hashlib
+import json
+import multiprocessing
+import os
+import threading
+import time
+
+from collections import OrderedDict
+from io import BytesIO
+from xml.etree import ElementTree
+
+try:
+    from xmltodict import unparse as XMLDecoder
+    from xmltodict import parse as XMLEncoder
+    HAS_XMLTODICT = True
+except ImportError:
+    HAS_XMLTODICT = False
+
+try:
+    from lxml import etree as lxml_etree
+    HAS_LXML = True
+except ImportError:
+    HAS_LXML = False
+
+from ansible.errors import AnsibleFilterError
 from ansible.plugins.filter.core import to_json
-from ansible.module_utils._text import to_text
+from ansible.module_utils._text import to_bytes, to_text
+from ansible.module_utils.six import binary_type, string_types, text_type
+
+
+class RenderCache(object):
+    '''Bounded LRU cache of rendered XML documents, keyed by content hash.
+
+    Ansible runs the filters of each task in a forked worker process, so
+    the cache lives as long as that worker: it serves the repeated renders
+    of one task and of every item of its loop, not those of later tasks.'''
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return None
+            # Re-insert to mark the entry as most recently used
+            self._data[key] = value
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def info(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._data),
+                'maxsize': self.maxsize
+            }
+
+
+# Cache of the current process, that is of the task being run. Set
+# DARKBULB_XML_CACHE_SIZE=0 to disable it.
+_RENDER_CACHE = RenderCache(
+    maxsize=int(os.environ.get('DARKBULB_XML_CACHE_SIZE', 1024)))
+
+
+XML_DECLARATION = '<?xml version="1.0" encoding="utf-8"?>\n'
+
+
+def _qname(name):
+    '''Map ElementTree "{uri}tag" names to the xmltodict "uri:tag" form'''
+    if name[:1] == '{':
+        uri, tag = name[1:].split('}', 1)
+        return '%s:%s' % (uri, tag)
+    return name
+
+def _element_to_dict(elem, attr_prefix='@', cdata_key='$', dict_constructor=dict,
+                     namespaces=None):
+    '''Convert an ElementTree element into the xmltodict representation
+
+    namespaces maps elements to the (prefix, uri) they declare, which
+    ElementTree does not keep. They become an xmlns attribute, like
+    xmltodict.'''
+    value = dict_constructor()
+    for name, attr in elem.attrib.items():
+        value[attr_prefix + _qname(name)] = attr
+    if namespaces and elem in namespaces:
+        value[attr_prefix + 'xmlns'] = dict_constructor(namespaces[elem])
+
+    text = [elem.text or '']
+    for child in elem:
+        if not isinstance(child.tag, string_types):
+            # Comments and processing instructions (lxml keeps them)
+            text.append(child.tail or '')
+            continue
+        tag = _qname(child.tag)
+        item = _element_to_dict(child, attr_prefix, cdata_key, dict_constructor,
+                                namespaces)
+        if tag not in value:
+            value[tag] = item
+        elif isinstance(value[tag], list):
+            value[tag].append(item)
+        else:
+            value[tag] = [value[tag], item]
+        text.append(child.tail or '')
+
+    text = ''.join(text).strip() or None
+    if not value:
+        return text
+    if text is not None:
+        value[cdata_key] = text
+    return value
+
+def _to_string(value):
+    '''Stringify a scalar the way xmltodict does'''
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return to_text(value, errors='surrogate_or_strict', nonstring='simplerepr')
+
+
+class XmlToDictEngine(object):
+    '''Pure Python engine built on xmltodict (reference implementation)'''
+
+    name = 'xmltodict'
+
+    def render(self, data, pretty=False, attr_prefix='@', cdata_key='$'):
+        return to_text( XMLDecoder( data,
+                                    pretty=pretty,
+                                    attr_prefix=attr_prefix,
+                                    cdata_key=cdata_key ),
+                        errors='surrogate_or_strict',
+                        nonstring='simplerepr' )
+
+    def parse(self, data, process_namespaces=True, attr_prefix='@',
+              cdata_key='$', dict_constructor=OrderedDict):
+        return XMLEncoder( data,
+                           process_namespaces=process_namespaces,
+                           attr_prefix=attr_prefix,
+                           cdata_key=cdata_key,
+                           dict_constructor=dict_constructor )
+
+    def iterparse(self, source, events):
+        return ElementTree.iterparse(source, events=events)
+
+
+class EtreeEngine(object):
+    '''Engine building and parsing trees with xml.etree.ElementTree
+
+    Output matches xmltodict except for attribute values holding quotes or
+    tabs, which are escaped differently but parse back to the same value.'''
+
+    name = 'etree'
+    etree = ElementTree
+
+    def render(self, data, pretty=False, attr_prefix='@', cdata_key='$'):
+        roots = [key for key in data if key != '#comment']
+        if len(roots) != 1:
+            raise ValueError('Document must have exactly one root.')
+        root = self._build(None, roots[0], data[roots[0]], pretty,
+                           attr_prefix, cdata_key, 0)
+        return XML_DECLARATION + self._tostring(root)
+
+    def _tostring(self, root):
+        return self.etree.tostring(root, encoding='unicode',
+                                   short_empty_elements=False)
+
+    def _append(self, parent, text):
+        '''Append character data at the current end of parent'''
+        if len(parent):
+            parent[-1].tail = (parent[-1].tail or '') + text
+        else:
+            parent.text = (parent.text or '') + text
+
+    def _build(self, parent, key, value, pretty, attr_prefix, cdata_key,
+               depth, newl='\n', indent='\t'):
+        if not hasattr(value, '__iter__') or \
+                isinstance(value, (string_types, binary_type, dict)):
+            value = [value]
+        elem = None
+        for item in value:
+            if item is None:
+                item = {}
+            elif not isinstance(item, (dict, text_type)):
+                item = _to_string(item)
+            if isinstance(item, text_type):
+                item = {cdata_key: item}
+
+            cdata = None
+            attrs = OrderedDict()
+            children = []
+            for ikey, ivalue in item.items():
+                if ikey == cdata_key:
+                    cdata = None if ivalue is None else _to_string(ivalue)
+                elif ikey.startswith(attr_prefix):
+                    name = ikey[len(attr_prefix):]
+                    if name == 'xmlns' and isinstance(ivalue, dict):
+                        for prefix, uri in ivalue.items():
+                            attrs['xmlns:%s' % prefix if prefix else 'xmlns'] = \
+                                '' if uri is None else _to_string(uri)
+                    else:
+                        attrs[name] = '' if ivalue is None else _to_string(ivalue)
+                elif not (isinstance(ivalue, list) and not ivalue):
+                    children.append((ikey, ivalue))
+
+            if pretty and parent is not None:
+                self._append(parent, depth * indent)
+            if parent is None:
+                elem = self.etree.Element(key, attrs)
+            else:
+                elem = self.etree.SubElement(parent, key, attrs)
+            if pretty and children:
+                elem.text = newl
+            for ckey, cvalue in children:
+                self._build(elem, ckey, cvalue, pretty, attr_prefix,
+                            cdata_key, depth + 1, newl, indent)
+            if cdata is not None:
+                self._append(elem, cdata)
+            if pretty and children:
+                self._append(elem, depth * indent)
+            if elem.text is None and not len(elem):
+                # Force <tag></tag> instead of <tag />, like xmltodict
+                elem.text = ''
+            if pretty and depth:
+                self._append(parent, newl)
+        return elem
+
+    def parse(self, data, process_namespaces=True, attr_prefix='@',
+              cdata_key='$', dict_constructor=OrderedDict):
+        if not process_namespaces:
+            raise AnsibleFilterError('The %s XML engine always processes '
+                                     'namespaces' % self.name)
+        data = to_bytes(data, errors='surrogate_or_strict')
+        if b'xmlns' in data:
+            root, namespaces = self._parse_namespaces(data)
+        else:
+            root, namespaces = self._fromstring(data), None
+        return dict_constructor([(_qname(root.tag),
+                                  _element_to_dict(root, attr_prefix, cdata_key,
+                                                   dict_constructor, namespaces))])
+
+    def _parse_namespaces(self, data):
+        '''Parse data, with the (prefix, uri) declared by each element'''
+        namespaces = {}
+        declared = []
+        root = None
+        for event, item in self.iterparse(BytesIO(data), events=('start-ns', 'start')):
+            if event == 'start-ns':
+                declared.append((item[0] or '', item[1]))
+                continue
+            if root is None:
+                root = item
+            if declared:
+                namespaces[item] = declared
+                declared = []
+        return root, namespaces
+
+    def _fromstring(self, data):
+        return self.etree.fromstring(data)
+
+    def iterparse(self, source, events):
+        return self.etree.iterparse(source, events=events)
+
+
+class LxmlEngine(EtreeEngine):
+    '''Engine building and parsing trees with lxml (libxml2)'''
+
+    name = 'lxml'
+    etree = lxml_etree if HAS_LXML else None
+
+    def render(self, data, pretty=False, attr_prefix='@', cdata_key='$'):
+        try:
+            return super(LxmlEngine, self).render(data, pretty, attr_prefix,
+                                                  cdata_key)
+        except ValueError:
+            # lxml refuses prefixed names such as qemu:commandline without
+            # a namespace map, fall back to ElementTree for those documents
+            return _ENGINES['etree'].render(data, pretty, attr_prefix, cdata_key)
+
+    def _tostring(self, root):
+        return self.etree.tostring(root, encoding='unicode')
+
+    def _fromstring(self, data):
+        parser = self.etree.XMLParser(resolve_entities=False, huge_tree=True)
+        return self.etree.fromstring(data, parser)
+
+    def iterparse(self, source, events):
+        return self.etree.iterparse(source, events=events, resolve_entities=False,
+                                    huge_tree=True)
+
+
+_ENGINES = {'etree': EtreeEngine()}
+if HAS_XMLTODICT:
+    _ENGINES['xmltodict'] = XmlToDictEngine()
+if HAS_LXML:
+    _ENGINES['lxml'] = LxmlEngine()
+
+
+def _engine(name=None):
+    '''Return the engine selected by name, DARKBULB_XML_ENGINE or default'''
+    name = name or os.environ.get('DARKBULB_XML_ENGINE') or \
+        ('xmltodict' if HAS_XMLTODICT else 'etree')
+    try:
+        return _ENGINES[name]
+    except KeyError:
+        raise AnsibleFilterError('XML engine %s is not available, use one of: '
+                                 '%s' % (name, ', '.join(sorted(_ENGINES))))
+
+def xml_engines(*args, **kw):
+    '''Return the names of the XML engines available on this controller'''
+    return sorted(_ENGINES)
+
+
+# Topology sections rendered by topology_to_xml, in provisioning order
+TOPOLOGY_KINDS = ('networks', 'pools', 'volumes', 'domains')
+
+try:
+    _MP_CONTEXT = multiprocessing.get_context('fork')
+except (AttributeError, ValueError):
+    _MP_CONTEXT = multiprocessing
+
+
+def _serialize(data):
+    '''Serialise data preserving key order: element order is significant
+    in the rendered document.'''
+    return json.dumps(data, separators=(',', ':'), default=to_text)
+
+
+def _render_key(payload, engine, pretty, attr_prefix, cdata_key):
+    '''Stable structural hash of the serialised input and the render options'''
+    options = '%s|%s|%s|%s|' % (engine, pretty, attr_prefix, cdata_key)
+    return hashlib.sha1(to_bytes(options + payload, errors='surrogate_or_strict')).hexdigest()
+
+
+def _render_payload(job):
+    '''Process pool entry point: render a serialised object'''
+    payload, engine, pretty, attr_prefix, cdata_key = job
+    data = json.loads(payload, object_pairs_hook=OrderedDict)
+    return _engine(engine).render(data, pretty, attr_prefix, cdata_key)
+
+
+def _render_timed(job):
+    '''Process pool entry point: render a serialised object, with the
+    seconds it took'''
+    start = time.time()
+    xml_text = _render_payload(job)
+    return xml_text, time.time() - start
+
+
+# File the filters append their timings to, one JSON record per line.
+# Set by the darkbulb_profile callback, nothing is recorded without it.
+PROFILE_SPOOL = 'DARKBULB_PROFILE_SPOOL'
+
+
+def _profile(name, start, kinds, objects=None, **fields):
+    '''Append the timings of a filter call to the profile spool
+
+    kinds maps each kind of document to its counters (count, cached,
+    bytes, seconds), objects lists the [kind, name, seconds, bytes] of the
+    documents actually rendered. The record is written with a single
+    append, so concurrent workers do not interleave.'''
+    path = os.environ.get(PROFILE_SPOOL)
+    if not path:
+        return
+    record = dict(fields, filter=name, pid=os.getpid(), start=start,
+                  seconds=round(time.time() - start, 6), kinds=kinds,
+                  objects=objects or [])
+    line = to_bytes(json.dumps(record, default=to_text) + '\n', errors='surrogate_or_strict')
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        try:
+            os.write(fd, line)
+        finally:
+            os.close(fd)
+    except (IOError, OSError):
+        pass
+
+
+def _counters():
+    return {'count': 0, 'cached': 0, 'bytes': 0, 'seconds': 0.0}
+
 
 def to_xml(data=dict(), *args, **kw):
     '''Convert JSON to XML'''
-    xml_data = XMLDecoder(  data,
-                            pretty=kw.get('pretty', False),
-                            attr_prefix=kw.get('attr_prefix', '@'),
-                            cdata_key=kw.get('cdata_key', '$') )
+    engine = _engine(kw.get('engine'))
+    pretty = kw.get('pretty', False)
+    attr_prefix = kw.get('attr_prefix', '@')
+    cdata_key = kw.get('cdata_key', '$')
+    start = time.time()
+    element = next(iter(data), '') if isinstance(data, dict) else ''
+
+    # Without cache, the input is neither serialized nor hashed
+    key = None
+    if _RENDER_CACHE.maxsize > 0:
+        key = _render_key(_serialize(data), engine.name, pretty, attr_prefix, cdata_key)
+        cached = _RENDER_CACHE.get(key)
+        if cached is not None:
+            _profile('to_xml', start, {element: {'count': 1, 'cached': 1, 'bytes': len(cached),
+                                                 'seconds': round(time.time() - start, 6)}})
+            return cached
+
+    xml_text = engine.render(data, pretty, attr_prefix, cdata_key)
+    if key is not None:
+        _RENDER_CACHE.set(key, xml_text)
+    _profile('to_xml', start, {element: {'count': 1, 'cached': 0, 'bytes': len(xml_text),
+                                         'seconds': round(time.time() - start, 6)}})
+    return xml_text
+
+def topology_to_xml(topology=dict(), *args, **kw):
+    '''Render every network, pool, volume and domain of a topology at once
 
-    return to_text( xml_data,
-                    errors='surrogate_or_strict',
-                    nonstring='simplerepr' )
+    Returns {kind: {name: xml}} keyed like the input topology. Cache misses
+    are spread across a process pool once there are at least
+    parallel_threshold of them; processes defaults to the CPU count. With
+    kinds, only those sections are rendered, the others are left empty.'''
+    engine = _engine(kw.get('engine')).name
+    pretty = kw.get('pretty', False)
+    attr_prefix = kw.get('attr_prefix', '@')
+    cdata_key = kw.get('cdata_key', '$')
+    processes = kw.get('processes') or multiprocessing.cpu_count()
+    threshold = kw.get('parallel_threshold', 64)
+    kinds = kw.get('kinds')
+    if kinds is None:
+        kinds = TOPOLOGY_KINDS
+    start = time.time()
+    counters = dict((kind, _counters()) for kind in TOPOLOGY_KINDS)
+
+    result = dict((kind, {}) for kind in TOPOLOGY_KINDS)
+    pending = []
+    caching = _RENDER_CACHE.maxsize > 0
+    for kind in TOPOLOGY_KINDS:
+        if kind not in kinds:
+            continue
+        for name, data in (topology.get(kind) or {}).items():
+            payload = _serialize(data)
+            key = cached = None
+            if caching:
+                key = _render_key(payload, engine, pretty, attr_prefix, cdata_key)
+                cached = _RENDER_CACHE.get(key)
+            if cached is not None:
+                result[kind][name] = cached
+                counters[kind]['cached'] += 1
+                counters[kind]['bytes'] += len(cached)
+            else:
+                pending.append((kind, name, key, payload))
+            counters[kind]['count'] += 1
+    hashed = time.time()
+
+    jobs = [(payload, engine, pretty, attr_prefix, cdata_key)
+            for kind, name, key, payload in pending]
+    parallel = processes > 1 and len(jobs) >= threshold \
+        and not multiprocessing.current_process().daemon
+    if parallel:
+        pool = _MP_CONTEXT.Pool(min(processes, len(jobs)))
+        try:
+            rendered = pool.map(_render_timed, jobs,
+                                chunksize=max(1, len(jobs) // (processes * 4)))
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        rendered = [_render_timed(job) for job in jobs]
+
+    objects = []
+    for (kind, name, key, payload), (xml_text, seconds) in zip(pending, rendered):
+        if key is not None:
+            _RENDER_CACHE.set(key, xml_text)
+        result[kind][name] = xml_text
+        counters[kind]['bytes'] += len(xml_text)
+        counters[kind]['seconds'] += seconds
+        objects.append([kind, name, round(seconds, 6), len(xml_text)])
+
+    if os.environ.get(PROFILE_SPOOL):
+        for kind in counters:
+            counters[kind]['seconds'] = round(counters[kind]['seconds'], 6)
+        _profile('topology_to_xml', start, dict((kind, counters[kind]) for kind in kinds
+                                                if kind in counters),
+                 objects, hash_seconds=round(hashed - start, 6),
+                 processes=min(processes, len(jobs)) if parallel else 1)
+    return result
+
+def topology_fingerprint(topology=dict(), *args, **kw):
+    '''Return {kind: sha1} of every section of a topology
+
+    A section keeps its fingerprint as long as none of its documents
+    change. salt is hashed into every fingerprint, for settings outside of
+    the topology that change the outcome of provisioning.'''
+    salt = to_text(kw.get('salt', ''))
+    fingerprints = {}
+    for kind in TOPOLOGY_KINDS:
+        digest = hashlib.sha1(to_bytes(salt))
+        section = topology.get(kind) or {}
+        for name in sorted(section):
+            digest.update(to_bytes('\0%s\0' % name, errors='surrogate_or_strict'))
+            digest.update(to_bytes(_serialize(section[name]), errors='surrogate_or_strict'))
+        fingerprints[kind] = digest.hexdigest()
+    return fingerprints
+
+def to_xml_cache_info(*args, **kw):
+    '''Return hit/miss/eviction counters of the to_xml render cache of the
+    current task'''
+    return _RENDER_CACHE.info()
+
+SCHEMA_DIR = os.environ.get('DARKBULB_XML_SCHEMA_DIR', '/usr/share/libvirt/schemas')
+
+# RelaxNG schema shipped by libvirt for each kind of topology document
+SCHEMAS = {
+    'networks': 'network.rng',
+    'pools': 'storagepool.rng',
+    'volumes': 'storagevol.rng',
+    'domains': 'domain.rng',
+}
+
+_SCHEMA_CACHE = {}
+_SCHEMA_LOCK = threading.Lock()
+
+
+def _schema(kind, schema_dir):
+    '''Return the compiled RelaxNG schema of kind, compiling it only once
+    per process'''
+    path = os.path.join(schema_dir, SCHEMAS[kind])
+    with _SCHEMA_LOCK:
+        schema = _SCHEMA_CACHE.get(path)
+        if schema is None:
+            try:
+                schema = lxml_etree.RelaxNG(lxml_etree.parse(path))
+            except (IOError, OSError, lxml_etree.LxmlError) as e:
+                raise AnsibleFilterError('Unable to load the %s schema %s: %s' % (
+                    kind, path, to_text(e)))
+            _SCHEMA_CACHE[path] = schema
+    return schema
+
+
+def validate_xml(documents=dict(), *args, **kw):
+    '''Validate rendered documents against the libvirt RelaxNG schemas
+
+    documents is either the {kind: {name: xml}} output of topology_to_xml
+    or a single XML document together with kind=. Every document is checked
+    in memory and all the errors are returned together as a list of
+    "kind/name:line: message" strings; an empty list means the whole batch
+    is valid. Schemas are read from schema_dir (default
+    /usr/share/libvirt/schemas, or DARKBULB_XML_SCHEMA_DIR).'''
+    if not HAS_LXML:
+        raise AnsibleFilterError('Schema validation requires the `lxml` module')
+
+    schema_dir = kw.get('schema_dir') or SCHEMA_DIR
+    kind = kw.get('kind')
+    if isinstance(documents, string_types + (binary_type,)):
+        if kind not in SCHEMAS:
+            raise AnsibleFilterError('kind must be one of %s' % ', '.join(sorted(SCHEMAS)))
+        documents = {kind: {kind: documents}}
+
+    parser = lxml_etree.XMLParser(resolve_entities=False, huge_tree=True)
+    errors = []
+    for kind in TOPOLOGY_KINDS:
+        if not documents.get(kind):
+            continue
+        schema = _schema(kind, schema_dir)
+        for name, xml_text in sorted(documents[kind].items()):
+            try:
+                tree = lxml_etree.fromstring(to_bytes(xml_text), parser)
+            except lxml_etree.XMLSyntaxError as e:
+                errors.append('%s/%s:%d: %s' % (kind, name, e.lineno or 0, e.msg))
+                continue
+            if not schema.validate(tree):
+                errors.extend('%s/%s:%d: %s' % (kind, name, entry.line, entry.message)
+                              for entry in schema.error_log)
+    return errors
+
+def iter_xml(data, path, attr_prefix='@', cdata_key='$', dict_constructor=dict,
+             engine=None):
+    '''Yield the subtrees of a XML document matching a slash separated path
+
+    Elements are discarded as soon as they are processed, so memory use is
+    bound by the size of the largest matching subtree, not the document.
+    A "*" path segment matches any element name.'''
+    target = [segment for segment in path.split('/') if segment]
+    depth = len(target)
+    if not hasattr(data, 'read'):
+        data = BytesIO(to_bytes(data, errors='surrogate_or_strict'))
+
+    stack, names = [], []
+    namespaces, declared = {}, []
+    for event, elem in _engine(engine).iterparse(data, events=('start-ns', 'start', 'end')):
+        if event == 'start-ns':
+            declared.append((elem[0] or '', elem[1]))
+            continue
+        if not isinstance(elem.tag, string_types):
+            continue
+        if event == 'start':
+            stack.append(elem)
+            names.append(elem.tag.rsplit('}', 1)[-1])
+            if declared:
+                namespaces[elem] = declared
+                declared = []
+            continue
+
+        inside = len(names) > depth and all(
+            want in ('*', name) for want, name in zip(target, names))
+        if len(names) == depth and all(
+                want in ('*', name) for want, name in zip(target, names)):
+            yield _element_to_dict(elem, attr_prefix, cdata_key, dict_constructor,
+                                   namespaces)
+
+        stack.pop()
+        names.pop()
+        if not inside:
+            for child in elem.iter():
+                namespaces.pop(child, None)
+            elem.clear()
+            if stack:
+                stack[-1].remove(elem)
 
 def from_xml(data='', *args, **kw):
-    '''Convert XML to JSON'''
-    ordered_dict_data = XMLEncoder( data,
-                                    process_namespaces=kw.get('process_namespaces', True),
-                                    attr_prefix=kw.get('attr_prefix', '@'),
-                                    cdata_key=kw.get('cdata_key', '$') )
+    '''Convert XML to JSON
+
+    native=True returns plain dicts instead of a JSON string, stream=<path>
+    returns the list of subtrees matching <path> (e.g. domain/devices/interface)
+    parsed incrementally.'''
+    engine = _engine(kw.get('engine'))
+    attr_prefix = kw.get('attr_prefix', '@')
+    cdata_key = kw.get('cdata_key', '$')
+    native = kw.get('native', False)
+
+    if kw.get('stream'):
+        items = list(iter_xml(data, kw['stream'],
+                              attr_prefix=attr_prefix,
+                              cdata_key=cdata_key,
+                              engine=engine.name))
+        return items if native else to_json(items)
+
+    ordered_dict_data = engine.parse( data,
+                                      process_namespaces=kw.get('process_namespaces', True),
+                                      attr_prefix=attr_prefix,
+                                      cdata_key=cdata_key,
+                                      dict_constructor=dict if native else OrderedDict )
 
+    if native:
+        return ordered_dict_data
     return to_json( ordered_dict_data )
 
 class FilterModule(object):
@@ -49,7 +687,12 @@ class FilterModule(object):
 
     filter_map = {
         'to_xml': to_xml,
-        'from_xml': from_xml
+        'to_xml_cache_info': to_xml_cache_info,
+        'topology_to_xml': topology_to_xml,
+        'topology_fingerprint': topology_fingerprint,
+        'from_xml': from_xml,
+        'validate_xml': validate_xml,
+        'xml_engines': xml_engines
     }
 
     def filters(self):
@@ -0,0 +1,186 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# (c) 2018, Victor da Costa <victorockeiro@gmail.com>
+#
+# This file is part of Ansible
+#
+# Ansible is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Ansible is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Ansible.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+ANSIBLE_METADATA = {'metadata_version': '1.1',
+                    'status': ['preview'],
+                    'supported_by': 'community'}
+
+DOCUMENTATION = '''
+---
+module: virt_artifacts
+short_description: Store rendered topology documents by content hash
+description:
+    - Writes every rendered document to C(<path>/<kind>/<sha1>.xml), named
+      after the hash of its content. Documents already stored are not
+      written again.
+    - Records the documents of each kind and the topology fingerprints in
+      C(<path>/manifest.json). The manifest is replaced atomically, sections
+      missing from I(documents) keep their previous entries.
+    - Documents no longer referenced by the manifest are removed from the
+      kinds that were stored.
+options:
+    path:
+        description:
+            - Configuration directory, C(darkbulb_topology.config.path).
+        required: true
+    documents:
+        description:
+            - Rendered documents, C({kind: {name: xml}}) as returned by the
+              C(topology_to_xml) filter. Empty kinds are left untouched.
+        default: {}
+    fingerprints:
+        description:
+            - Section fingerprints, as returned by the
+              C(topology_fingerprint) filter, merged into the manifest.
+        default: {}
+    owner:
+        description:
+            - Owner of the written files.
+    group:
+        description:
+            - Group of the written files.
+author:
+    - Victor da Costa (@victorock)
+'''
+
+EXAMPLES = '''
+- name: Store the rendered topology
+  virt_artifacts:
+    path:         "{{ darkbulb_topology.config.path }}"
+    documents:    "{{ darkbulb_topology_xml }}"
+    fingerprints: "{{ darkbulb_topology | topology_fingerprint }}"
+'''
+
+RETURN = '''
+manifest:
+    description: Content of the manifest after the update.
+    returned: always
+    type: dict
+    sample: {"fingerprints": {"domains": "5d41402abc4b2a76b9719d911017c592ae5a3f2b"},
+             "objects": {"domains": {"leaf01": "aaf4c61ddcc5e8a2dabede0f3b482cd9aea9434d"}}}
+written:
+    description: Number of documents written.
+    returned: always
+    type: int
+pruned:
+    description: Number of documents no longer referenced and removed.
+    returned: always
+    type: int
+'''
+
+import hashlib
+import json
+import os
+import tempfile
+
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils._text import to_bytes, to_native
+
+MANIFEST = 'manifest.json'
+
+
+def load_manifest(path):
+    try:
+        with open(path) as manifest:
+            data = json.load(manifest)
+    except (IOError, OSError, ValueError):
+        data = {}
+    data.setdefault('fingerprints', {})
+    data.setdefault('objects', {})
+    return data
+
+
+def write_atomic(module, path, content):
+    '''Write content to a temporary file of the same directory, then move
+    it in place'''
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.darkbulb-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(to_bytes(content))
+        module.atomic_move(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+    file_args = module.load_file_common_arguments(dict(path=path,
+                                                       owner=module.params['owner'],
+                                                       group=module.params['group']))
+    module.set_fs_attributes_if_different(file_args, False)
+
+
+def main():
+    module = AnsibleModule(
+        argument_spec=dict(
+            path=dict(type='path', required=True),
+            documents=dict(type='dict', default={}),
+            fingerprints=dict(type='dict', default={}),
+            owner=dict(),
+            group=dict(),
+        ),
+    )
+
+    path = module.params['path']
+    manifest_path = os.path.join(path, MANIFEST)
+    manifest = load_manifest(manifest_path)
+    previous = json.dumps(manifest, sort_keys=True)
+    written = 0
+    pruned = 0
+
+    try:
+        for kind, documents in sorted(module.params['documents'].items()):
+            if not documents:
+                continue
+            directory = os.path.join(path, kind)
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+
+            objects = {}
+            for name, xml in sorted(documents.items()):
+                digest = hashlib.sha1(to_bytes(xml)).hexdigest()
+                objects[name] = digest
+                target = os.path.join(directory, digest + '.xml')
+                if not os.path.exists(target):
+                    write_atomic(module, target, xml)
+                    written += 1
+
+            stale = set(manifest['objects'].get(kind, {}).values()) - set(objects.values())
+            for digest in stale:
+                try:
+                    os.unlink(os.path.join(directory, digest + '.xml'))
+                    pruned += 1
+                except OSError:
+                    pass
+            manifest['objects'][kind] = objects
+
+        manifest['fingerprints'].update(module.params['fingerprints'])
+        content = json.dumps(manifest, sort_keys=True)
+        changed = bool(written or pruned) or content != previous
+        if content != previous:
+            write_atomic(module, manifest_path, json.dumps(manifest, indent=2, sort_keys=True))
+    except (IOError, OSError) as e:
+        module.fail_json(msg='Unable to store artifacts in %s: %s' % (path, to_native(e)))
+
+    module.exit_json(changed=changed, manifest=manifest, written=written, pruned=pruned)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,270 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# (c) 2018, Victor da Costa <victorockeiro@gmail.com>
+#
+# This file is part of Ansible
+#
+# Ansible is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Ansible is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Ansible.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+ANSIBLE_METADATA = {'metadata_version': '1.1',
+                    'status': ['preview'],
+                    'supported_by': 'community'}
+
+DOCUMENTATION = '''
+---
+module: virt_console_wait
+short_description: Wait until domains have booted, watching their serial consoles
+description:
+    - Attaches to the pty serial console of every domain at once and waits
+      until one of I(prompts) shows up on each of them.
+    - All consoles are watched concurrently by a single asyncio event loop,
+      the total wait is the one of the slowest boot.
+    - A carriage return is sent periodically to the consoles still booting,
+      so images waiting for RETURN print their prompt.
+options:
+    uri:
+        description:
+            - libvirt connection uri, used to find the console pty of each
+              domain in I(domains).
+        default: qemu:///system
+    domains:
+        description:
+            - Names of running domains whose serial console is watched.
+        default: []
+    consoles:
+        description:
+            - Console pty paths keyed by name, watched without asking
+              libvirt. Any pseudo-terminal works.
+        default: {}
+    prompts:
+        description:
+            - Regular expressions, a console is ready as soon as its output
+              matches one of them.
+            - They are compiled without flags, C(^) and C($) anchor to the
+              whole output unless the expression starts with C((?m)).
+            - The default prompt is matched line by line.
+        default: [ '[\\w.-]+(\\(config[\\w-]*\\))?[>#]\\s*$' ]
+    timeout:
+        description:
+            - Seconds to wait for all consoles.
+        default: 600
+    wakeup:
+        description:
+            - Seconds between two carriage returns sent to a console which is
+              not ready yet, C(0) never sends anything.
+        default: 5
+requirements:
+    - "python >= 3.5"
+    - "libvirt-python (only with I(domains))"
+author:
+    - Victor da Costa (@victorock)
+'''
+
+EXAMPLES = '''
+- name: Wait for every node to reach its prompt
+  virt_console_wait:
+    domains: "{{ darkbulb_topology.domains | dict2items | map(attribute='value.domain.name') | list }}"
+    timeout: 900
+
+- name: Watch explicit pseudo-terminals
+  virt_console_wait:
+    consoles:
+      leaf01: /dev/pts/3
+    prompts:
+      - 'Press RETURN to get started'
+'''
+
+RETURN = '''
+results:
+    description:
+        - Per console outcome. C(elapsed) is the time the console took to
+          become ready, C(match) the text that matched.
+    returned: always
+    type: list
+    sample: [{"name": "leaf01-ios", "path": "/dev/pts/3", "ready": true,
+              "elapsed": 93.51, "match": "leaf01#"}]
+elapsed:
+    description: Wall clock time spent waiting, in seconds.
+    returned: always
+    type: float
+'''
+
+import asyncio
+import os
+import re
+import termios
+import time
+import tty
+
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils._text import to_native, to_text
+from ansible.module_utils.darkbulb_virt import HAS_VIRT, console_path
+
+# Only the tail of the output is searched, prompts are at the end of it
+WINDOW = 4096
+
+# "name>" or "name(config-if)#" prompt of the network images
+DEFAULT_PROMPT = r'[\w.-]+(\(config[\w-]*\))?[>#]\s*$'
+
+
+class Console(object):
+    '''Output of a console pty, matched against the prompts as it arrives'''
+
+    def __init__(self, name, path, prompts):
+        self.name = name
+        self.path = path
+        self.prompts = prompts
+        self.buffer = ''
+        self.fd = None
+        self.result = {'name': name, 'path': path, 'ready': False}
+
+    def open(self, loop, ready):
+        self.fd = os.open(self.path, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+        # Raw mode: prompts do not end with a newline. Apply it at once, the
+        # default would flush what the console printed before we attached
+        tty.setraw(self.fd, termios.TCSANOW)
+        loop.add_reader(self.fd, self.read, loop, ready)
+
+    def read(self, loop, ready):
+        try:
+            data = os.read(self.fd, WINDOW)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            # The other end of the pty went away
+            data = b''
+        if not data:
+            loop.remove_reader(self.fd)
+            return
+        self.buffer = (self.buffer + to_text(data, errors='replace'))[-WINDOW:]
+        for prompt in self.prompts:
+            match = prompt.search(self.buffer)
+            if match and not ready.done():
+                self.result['match'] = match.group(0).strip()
+                ready.set_result(True)
+                return
+
+    def wakeup(self):
+        try:
+            os.write(self.fd, b'\r')
+        except OSError:
+            pass
+
+    def close(self, loop):
+        if self.fd is not None:
+            loop.remove_reader(self.fd)
+            os.close(self.fd)
+
+
+async def watch(loop, console, start, timeout, wakeup):
+    ready = loop.create_future()
+    try:
+        console.open(loop, ready)
+    except OSError as e:
+        console.result['msg'] = to_native(e)
+        return console.result
+    try:
+        deadline = start + timeout
+        while not ready.done():
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                console.result['msg'] = 'No prompt after %ss' % timeout
+                break
+            if wakeup:
+                console.wakeup()
+            try:
+                await asyncio.wait_for(asyncio.shield(ready),
+                                       min(remaining, wakeup or remaining))
+            except asyncio.TimeoutError:
+                pass
+        if ready.done():
+            console.result['ready'] = True
+            console.result['elapsed'] = round(loop.time() - start, 3)
+    finally:
+        console.close(loop)
+    return console.result
+
+
+async def watch_all(loop, consoles, timeout, wakeup):
+    start = loop.time()
+    return await asyncio.gather(*[watch(loop, console, start, timeout, wakeup)
+                                  for console in consoles])
+
+
+def wait_all(consoles, timeout, wakeup):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(watch_all(loop, consoles, timeout, wakeup))
+    finally:
+        loop.close()
+
+
+def main():
+    module = AnsibleModule(
+        argument_spec=dict(
+            uri=dict(default='qemu:///system'),
+            domains=dict(type='list', default=[]),
+            consoles=dict(type='dict', default={}),
+            prompts=dict(type='list'),
+            timeout=dict(type='float', default=600),
+            wakeup=dict(type='float', default=5),
+        ),
+    )
+
+    try:
+        if module.params['prompts']:
+            prompts = [re.compile(prompt) for prompt in module.params['prompts']]
+        else:
+            prompts = [re.compile(DEFAULT_PROMPT, re.M)]
+    except re.error as e:
+        module.fail_json(msg='Invalid prompt: %s' % to_native(e))
+
+    paths = dict(module.params['consoles'])
+    if module.params['domains']:
+        if not HAS_VIRT:
+            module.fail_json(msg='The `libvirt` module is not importable. Check the requirements.')
+        import libvirt
+        try:
+            conn = libvirt.openReadOnly(module.params['uri'])
+            try:
+                for name in module.params['domains']:
+                    paths[name] = console_path(conn, name)
+            finally:
+                conn.close()
+        except libvirt.libvirtError as e:
+            module.fail_json(msg=to_native(e))
+
+    missing = sorted(name for name, path in paths.items() if not path)
+    if missing:
+        module.fail_json(msg='No pty console for: %s' % ', '.join(missing))
+
+    start = time.time()
+    results = wait_all([Console(name, path, prompts)
+                        for name, path in sorted(paths.items())],
+                       module.params['timeout'], module.params['wakeup'])
+    output = dict(changed=False, results=results,
+                  elapsed=round(time.time() - start, 3))
+
+    waiting = [result['name'] for result in results if not result['ready']]
+    if waiting:
+        module.fail_json(msg='Not ready: %s' % ', '.join(waiting), **output)
+    module.exit_json(**output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,305 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# (c) 2018, Victor da Costa <victorockeiro@gmail.com>
+#
+# This file is part of Ansible
+#
+# Ansible is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Ansible is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Ansible.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+ANSIBLE_METADATA = {'metadata_version': '1.1',
+                    'status': ['preview'],
+                    'supported_by': 'community'}
+
+DOCUMENTATION = '''
+---
+module: virt_topology
+short_description: Provision libvirt networks, pools, volumes and domains concurrently
+description:
+    - Defines, starts and marks for autostart many libvirt networks,
+      storage pools, volumes and domains in a single call.
+    - Objects are provisioned by a bounded pool of worker threads, each
+      using its own libvirt connection.
+    - A dependency graph is built from the documents, a domain waits for the
+      networks of its interfaces and the volumes of its disks, a volume waits
+      for its pool. Every object starts as soon as its own dependencies are
+      ready. Teardown walks the same graph in reverse order.
+    - With I(state=absent), each kind may also be given as a plain list of
+      names. Teardown then needs no XML at all, objects are removed stage by
+      stage (domains, then networks and volumes, then pools) by the pool of
+      workers, volumes in one batch per worker.
+    - Networks, pools and domains are only redefined when their live
+      definition differs from the desired one. Both documents are compared
+      after dropping values libvirt generates on its own, such as uuids,
+      auto-assigned PCI addresses and device aliases.
+options:
+    uri:
+        description:
+            - libvirt connection uri.
+        default: qemu:///system
+    networks:
+        description:
+            - Network XML documents keyed by name, as returned by the
+              C(topology_to_xml) filter.
+        default: {}
+    pools:
+        description:
+            - Storage pool XML documents keyed by name.
+        default: {}
+    volumes:
+        description:
+            - Storage volume XML documents keyed by name, created in
+              I(volume_pool) unless they already exist.
+        default: {}
+    volume_pool:
+        description:
+            - Name of the storage pool volumes are created in.
+        default: default
+    base_image:
+        description:
+            - Base image every volume is a qcow2 overlay of, unless its
+              document already has a C(backingStore). A relative name is
+              looked up in the target directory of I(volume_pool).
+            - Overlays only store the blocks written by their domain, so
+              creating hundreds of node disks takes seconds and almost no
+              space.
+    base_format:
+        description:
+            - Format of I(base_image).
+        default: qcow2
+    volume_method:
+        description:
+            - C(libvirt) creates volumes through the storage pool,
+              C(qemu-img) runs I(qemu_img) directly in the pool directory
+              and refreshes the pool once at the end.
+        choices: [ libvirt, qemu-img ]
+        default: libvirt
+    qemu_img:
+        description:
+            - Path of the qemu-img binary used by C(volume_method=qemu-img).
+        default: qemu-img
+    domains:
+        description:
+            - Domain XML documents keyed by name.
+        default: {}
+    state:
+        description:
+            - C(running) defines, starts and sets autostart on every object,
+              C(defined) only defines them, C(absent) stops and removes them.
+        choices: [ running, defined, absent ]
+        default: running
+    autostart:
+        description:
+            - Mark started objects to be started on boot.
+        type: bool
+        default: 'yes'
+    workers:
+        description:
+            - Maximum number of concurrent libvirt connections.
+        default: 8
+    force:
+        description:
+            - Redefine every object, even when its live definition already
+              matches the desired one.
+        type: bool
+        default: 'no'
+requirements:
+    - "python >= 2.6"
+    - "libvirt-python"
+author:
+    - Victor da Costa (@victorock)
+'''
+
+EXAMPLES = '''
+- name: Bring up the topology
+  virt_topology:
+    networks: "{{ darkbulb_topology_xml.networks }}"
+    pools:    "{{ darkbulb_topology_xml.pools }}"
+    volumes:  "{{ darkbulb_topology_xml.volumes }}"
+    domains:  "{{ darkbulb_topology_xml.domains }}"
+    workers:  16
+
+- name: Create the node disks as overlays of a shared base image
+  virt_topology:
+    pools:         "{{ darkbulb_topology_xml.pools }}"
+    volumes:       "{{ darkbulb_topology_xml.volumes }}"
+    base_image:    vios_l2-adventerprisek9-m.03.2017.qcow2
+    volume_method: qemu-img
+
+- name: Tear down the topology
+  virt_topology:
+    networks: "{{ darkbulb_topology_xml.networks }}"
+    pools:    "{{ darkbulb_topology_xml.pools }}"
+    volumes:  "{{ darkbulb_topology_xml.volumes }}"
+    domains:  "{{ darkbulb_topology_xml.domains }}"
+    state:    absent
+
+- name: Tear down the topology from names only
+  virt_topology:
+    networks: [ darkbulb ]
+    pools:    [ default ]
+    volumes:  "{{ darkbulb_topology.volumes | dict2items | map(attribute='value.volume.name') | list }}"
+    domains:  "{{ darkbulb_topology.domains | dict2items | map(attribute='value.domain.name') | list }}"
+    state:    absent
+
+- name: Exercise the module against the libvirt test driver
+  virt_topology:
+    uri:      test:///default
+    domains:  "{{ darkbulb_topology_xml.domains }}"
+'''
+
+RETURN = '''
+results:
+    description:
+        - Per object outcome. C(started) is the offset from the start of the
+          run at which the object was scheduled, C(depends) lists the objects
+          it waited for and C(timings) the seconds spent in each libvirt
+          call (or qemu-img run) of its C(actions).
+    returned: always
+    type: list
+    sample: [{"kind": "domains", "key": "leaf01", "name": "leaf01-ios",
+              "changed": true, "failed": false,
+              "actions": ["define", "create", "autostart"],
+              "depends": ["networks/darkbulb", "volumes/leaf01"],
+              "timings": {"define": 0.0213, "create": 0.0158, "autostart": 0.0009},
+              "started": 0.0812, "elapsed": 0.0421}]
+elapsed:
+    description: Wall clock time spent provisioning, in seconds.
+    returned: always
+    type: float
+'''
+
+import time
+
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.darkbulb_virt import (HAS_VIRT, PROVISIONERS,
+                                                REMOVERS, ConnectionPool,
+                                                reverse_graph, run_graph,
+                                                teardown, topology_graph,
+                                                xml_name)
+
+KINDS = ('networks', 'pools', 'volumes', 'domains')
+
+
+def provision(module, pool, topology, options):
+    state = options['state']
+    graph = topology_graph(topology, options['volume_pool'])
+    if state == 'absent':
+        handlers = REMOVERS
+        schedule = reverse_graph(graph)
+    else:
+        handlers = PROVISIONERS
+        schedule = graph
+
+    def job(kind, xml):
+        handler = handlers[kind]
+        if state == 'absent':
+            return lambda conn: handler(conn, xml_name(xml), **options)
+        return lambda conn: handler(conn, xml, **options)
+
+    jobs = [((kind, key), job(kind, xml))
+            for kind in KINDS
+            for key, xml in sorted(topology[kind].items())]
+
+    results = run_graph(pool, jobs, schedule, module.params['workers'])
+    if options['volume_method'] == 'qemu-img' and state != 'absent' and \
+            any(r['changed'] for r in results if r['kind'] == 'volumes'):
+        # Images were created behind the back of libvirt
+        conn = pool.acquire()
+        try:
+            conn.storagePoolLookupByName(options['volume_pool']).refresh(0)
+        finally:
+            pool.release(conn)
+
+    for result in results:
+        result['name'] = xml_name(topology[result['kind']][result['key']])
+        result['depends'] = sorted('%s/%s' % dep
+                                   for dep in schedule[(result['kind'], result['key'])])
+    return results
+
+
+def main():
+    module = AnsibleModule(
+        argument_spec=dict(
+            uri=dict(default='qemu:///system'),
+            networks=dict(type='raw', default={}),
+            pools=dict(type='raw', default={}),
+            volumes=dict(type='raw', default={}),
+            volume_pool=dict(default='default'),
+            base_image=dict(),
+            base_format=dict(default='qcow2'),
+            volume_method=dict(default='libvirt', choices=['libvirt', 'qemu-img']),
+            qemu_img=dict(default='qemu-img'),
+            domains=dict(type='raw', default={}),
+            state=dict(default='running', choices=['running', 'defined', 'absent']),
+            autostart=dict(type='bool', default=True),
+            workers=dict(type='int', default=8),
+            force=dict(type='bool', default=False),
+        ),
+    )
+
+    if not HAS_VIRT:
+        module.fail_json(msg='The `libvirt` module is not importable. Check the requirements.')
+
+    state = module.params['state']
+    options = dict(state=state,
+                   autostart=module.params['autostart'],
+                   volume_pool=module.params['volume_pool'],
+                   base_image=module.params['base_image'],
+                   base_format=module.params['base_format'],
+                   volume_method=module.params['volume_method'],
+                   qemu_img=module.params['qemu_img'],
+                   force=module.params['force'])
+    topology = dict((kind, module.params[kind] or {}) for kind in KINDS)
+    for kind, value in topology.items():
+        if not isinstance(value, (dict, list)):
+            module.fail_json(msg='%s must be a dict of XML documents or a list of names' % kind)
+
+    by_name = any(isinstance(value, list) for value in topology.values())
+    if by_name and state != 'absent':
+        module.fail_json(msg='Lists of names are only supported with state=absent')
+
+    pool = ConnectionPool(module.params['uri'], module.params['workers'])
+    start = time.time()
+    try:
+        if by_name:
+            names = dict((kind, value if isinstance(value, list)
+                          else [xml_name(xml) for xml in value.values()])
+                         for kind, value in topology.items())
+            results = teardown(pool, names, module.params['workers'],
+                               module.params['volume_pool'])
+            for result in results:
+                result['name'] = result['key']
+                result['depends'] = []
+        else:
+            results = provision(module, pool, topology, options)
+    finally:
+        pool.close()
+
+    failed = [result for result in results if result['failed']]
+    output = dict(changed=any(result['changed'] for result in results),
+                  results=results,
+                  elapsed=round(time.time() - start, 6))
+    if failed:
+        module.fail_json(msg='Failed to provision %d object(s): %s' % (
+            len(failed), ', '.join('%s/%s' % (r['kind'], r['key']) for r in failed)),
+            **output)
+    module.exit_json(**output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,595 @@
+# (c) 2018, Victor da Costa <victorockeiro@gmail.com>
+#
+# This file is part of Ansible
+#
+# Ansible is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Ansible is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Ansible.  If not, see <http://www.gnu.org/licenses/>.
+
+# Make coding more python3-ish
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import hashlib
+import os
+import subprocess
+import threading
+import time
+
+from xml.etree import ElementTree
+
+from ansible.module_utils._text import to_bytes, to_native, to_text
+from ansible.module_utils.six.moves import queue
+
+try:
+    import libvirt
+    HAS_VIRT = True
+except ImportError:
+    HAS_VIRT = False
+
+
+class ConnectionPool(object):
+    '''Bounded pool of libvirt connections shared by worker threads'''
+
+    def __init__(self, uri, size):
+        self.uri = uri
+        self.size = size
+        self._idle = queue.Queue()
+        self._opened = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            spawn = self._idle.empty() and self._opened < self.size
+            if spawn:
+                self._opened += 1
+        if spawn:
+            try:
+                return libvirt.open(self.uri)
+            except Exception:
+                with self._lock:
+                    self._opened -= 1
+                raise
+        return self._idle.get()
+
+    def release(self, conn):
+        self._idle.put(conn)
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+def xml_name(xml):
+    '''Return the <name> of a libvirt XML document'''
+    try:
+        return ElementTree.fromstring(to_bytes(xml)).findtext('name')
+    except ElementTree.ParseError:
+        return None
+
+
+def _missing(e, code):
+    return isinstance(e, libvirt.libvirtError) and e.get_error_code() == code
+
+
+def _lookup(lookup, name, code):
+    '''Return the libvirt object called name, or None when it does not exist'''
+    try:
+        return lookup(name)
+    except libvirt.libvirtError as e:
+        if _missing(e, code):
+            return None
+        raise
+
+
+def console_path(conn, name):
+    '''Return the pty of the serial console of a running domain, or None'''
+    tree = ElementTree.fromstring(to_bytes(conn.lookupByName(name).XMLDesc(0)))
+    for device in ('serial', 'console'):
+        for elem in tree.iterfind("devices/%s[@type='pty']" % device):
+            source = elem.find('source')
+            path = (source is not None and source.get('path')) or elem.get('tty')
+            if path:
+                return path
+    return None
+
+
+# Elements libvirt fills in when a definition leaves them out, including the
+# default devices QEMU domains get on define (audio without graphics, video,
+# rng, watchdog, the console of a serial port...). They are only compared
+# when the desired document sets them.
+GENERATED = frozenset([
+    'address', 'alias', 'allocation', 'audio', 'available', 'backingStore',
+    'bridge', 'capacity', 'clock', 'console', 'controller', 'cpu',
+    'currentMemory', 'emulator', 'input', 'mac', 'memballoon', 'model',
+    'nat', 'numatune', 'on_crash', 'on_poweroff', 'on_reboot', 'permissions',
+    'pm', 'resource', 'rng', 'seclabel', 'source', 'target', 'uuid', 'video',
+    'watchdog',
+])
+
+UNITS = {
+    'B': 1, 'b': 1, 'bytes': 1,
+    'KB': 10 ** 3, 'MB': 10 ** 6, 'GB': 10 ** 9, 'TB': 10 ** 12,
+    'k': 2 ** 10, 'KiB': 2 ** 10, 'M': 2 ** 20, 'MiB': 2 ** 20,
+    'G': 2 ** 30, 'GiB': 2 ** 30, 'T': 2 ** 40, 'TiB': 2 ** 40,
+}
+
+
+def canonical(elem, desired=None):
+    '''Return a comparable form of a libvirt XML element.
+
+    Sizes are converted to bytes, whitespace and sibling order across
+    element types are ignored. When desired is given, attributes and
+    GENERATED children that desired does not set are dropped, so values
+    libvirt assigns on its own (uuid, PCI addresses, aliases, bridge names,
+    default controllers, ...) do not count as differences.'''
+    attrib = dict(elem.attrib)
+    text = (elem.text or '').strip()
+    unit = attrib.pop('unit', None)
+    if unit in UNITS and text.isdigit():
+        text = str(int(text) * UNITS[unit])
+    if desired is not None:
+        attrib = dict((name, value) for name, value in attrib.items()
+                      if name in desired.attrib)
+
+    peers = {}
+    if desired is not None:
+        for child in desired:
+            peers.setdefault(child.tag, []).append(child)
+
+    seen = {}
+    children = []
+    for child in elem:
+        index = seen.get(child.tag, 0)
+        seen[child.tag] = index + 1
+        counterpart = None
+        if desired is not None:
+            candidates = peers.get(child.tag, [])
+            if not candidates and child.tag in GENERATED:
+                continue
+            if index < len(candidates):
+                counterpart = candidates[index]
+        children.append(canonical(child, counterpart))
+
+    # Stable sort: libvirt reorders elements by type, but keeps the order
+    # of devices of the same type
+    children.sort(key=lambda child: child[0])
+    return (elem.tag, tuple(sorted(attrib.items())), text, tuple(children))
+
+
+def fingerprint(xml, desired=None):
+    '''Hash of the canonical form of a XML document'''
+    tree = ElementTree.fromstring(to_bytes(xml))
+    if desired is not None:
+        desired = ElementTree.fromstring(to_bytes(desired))
+    return hashlib.sha1(to_bytes(repr(canonical(tree, desired)))).hexdigest()
+
+
+def same_definition(live, desired):
+    '''Whether a live libvirt definition already matches the desired one'''
+    return fingerprint(live, desired) == fingerprint(desired, desired)
+
+
+# Per thread {action: seconds} of the job run_graph is running
+_TIMINGS = threading.local()
+
+
+def _act(actions, action, func, *args):
+    '''Call func, then record action and the time it took'''
+    start = time.time()
+    value = func(*args)
+    actions.append(action)
+    timings = getattr(_TIMINGS, 'value', None)
+    if timings is not None:
+        timings[action] = round(timings.get(action, 0) + time.time() - start, 6)
+    return value
+
+
+def _define(obj, xml, flags, define, force):
+    '''Define xml unless the live definition of obj already matches it'''
+    if obj is not None and not force and same_definition(obj.XMLDesc(flags), xml):
+        return obj, []
+    actions = []
+    return _act(actions, 'define', define, xml), actions
+
+
+def ensure_network(conn, xml, state='running', autostart=True, force=False, **options):
+    net = _lookup(conn.networkLookupByName, xml_name(xml), libvirt.VIR_ERR_NO_NETWORK)
+    net, actions = _define(net, xml, libvirt.VIR_NETWORK_XML_INACTIVE,
+                           conn.networkDefineXML, force)
+    if state == 'running':
+        if not net.isActive():
+            _act(actions, 'create', net.create)
+        if autostart and not net.autostart():
+            _act(actions, 'autostart', net.setAutostart, 1)
+    return actions
+
+
+def ensure_pool(conn, xml, state='running', autostart=True, force=False, **options):
+    pool = _lookup(conn.storagePoolLookupByName, xml_name(xml), libvirt.VIR_ERR_NO_STORAGE_POOL)
+    pool, actions = _define(pool, xml, libvirt.VIR_STORAGE_XML_INACTIVE,
+                            lambda xml: conn.storagePoolDefineXML(xml, 0), force)
+    if state == 'running':
+        if not pool.isActive():
+            _act(actions, 'create', pool.create, 0)
+        if autostart and not pool.autostart():
+            _act(actions, 'autostart', pool.setAutostart, 1)
+    return actions
+
+
+def pool_file(pool, name):
+    '''Path of name in the target directory of a storage pool, name is
+    returned unchanged when it is already absolute'''
+    if os.path.isabs(name):
+        return name
+    target = ElementTree.fromstring(to_bytes(pool.XMLDesc(0))).findtext('target/path')
+    return os.path.join(target or '', name)
+
+
+def overlay(xml, backing, backing_format='qcow2'):
+    '''Turn a volume document into a qcow2 overlay of backing
+
+    Documents with their own backingStore are returned unchanged.'''
+    tree = ElementTree.fromstring(to_bytes(xml))
+    if tree.find('backingStore') is not None:
+        return xml
+    store = ElementTree.SubElement(tree, 'backingStore')
+    ElementTree.SubElement(store, 'path').text = backing
+    ElementTree.SubElement(store, 'format').set('type', backing_format)
+    target = tree.find('target')
+    if target is None:
+        target = ElementTree.SubElement(tree, 'target')
+    if target.find('format') is None:
+        ElementTree.SubElement(target, 'format').set('type', 'qcow2')
+    return to_text(ElementTree.tostring(tree))
+
+
+def qemu_img_create(path, xml, qemu_img='qemu-img'):
+    '''Create the image of a volume document with qemu-img, without
+    going through libvirt'''
+    tree = ElementTree.fromstring(to_bytes(xml))
+    capacity = tree.find('capacity')
+    unit = capacity.get('unit', 'bytes')
+    if unit not in UNITS:
+        raise Exception('Unknown capacity unit %s of volume %s' % (unit, xml_name(xml)))
+    size = int(capacity.text.strip()) * UNITS[unit]
+    image_format = tree.find('target/format')
+    command = [qemu_img, 'create', '-q', '-f',
+               'qcow2' if image_format is None else image_format.get('type')]
+    store = tree.find('backingStore')
+    if store is not None:
+        command += ['-b', store.findtext('path')]
+        if store.find('format') is not None:
+            command += ['-F', store.find('format').get('type')]
+    command += [path, str(size)]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stdout, stderr = process.communicate()
+    if process.returncode != 0:
+        raise Exception('%s failed: %s' % (' '.join(command), to_native(stderr).strip()))
+
+
+def ensure_volume(conn, xml, state='running', autostart=True, volume_pool=None,
+                  base_image=None, base_format='qcow2', volume_method='libvirt',
+                  qemu_img='qemu-img', **options):
+    pool = conn.storagePoolLookupByName(volume_pool)
+    actions = []
+    if not pool.isActive():
+        # Volumes can only be created, or looked up, in a started pool
+        if state != 'running':
+            raise Exception('Storage pool %s is not active' % volume_pool)
+        try:
+            _act(actions, 'pool-create', pool.create, 0)
+        except libvirt.libvirtError:
+            # Started meanwhile by the job of another volume
+            if not pool.isActive():
+                raise
+    if base_image:
+        xml = overlay(xml, pool_file(pool, base_image), base_format)
+    if volume_method == 'qemu-img':
+        path = pool_file(pool, xml_name(xml))
+        if not os.path.exists(path):
+            _act(actions, 'qemu-img', qemu_img_create, path, xml, qemu_img)
+        return actions
+    if not _lookup(pool.storageVolLookupByName, xml_name(xml), libvirt.VIR_ERR_NO_STORAGE_VOL):
+        _act(actions, 'create', pool.createXML, xml, 0)
+    return actions
+
+
+def ensure_domain(conn, xml, state='running', autostart=True, force=False, **options):
+    dom = _lookup(conn.lookupByName, xml_name(xml), libvirt.VIR_ERR_NO_DOMAIN)
+    dom, actions = _define(dom, xml, libvirt.VIR_DOMAIN_XML_INACTIVE,
+                           conn.defineXML, force)
+    if state == 'running':
+        if not dom.isActive():
+            _act(actions, 'create', dom.create)
+        if autostart and not dom.autostart():
+            _act(actions, 'autostart', dom.setAutostart, 1)
+    return actions
+
+
+def remove_network(conn, name, **options):
+    net = _lookup(conn.networkLookupByName, name, libvirt.VIR_ERR_NO_NETWORK)
+    if net is None:
+        return []
+    actions = []
+    if net.isActive():
+        _act(actions, 'destroy', net.destroy)
+    _act(actions, 'undefine', net.undefine)
+    return actions
+
+
+def remove_pool(conn, name, **options):
+    pool = _lookup(conn.storagePoolLookupByName, name, libvirt.VIR_ERR_NO_STORAGE_POOL)
+    if pool is None:
+        return []
+    actions = []
+    if pool.isActive():
+        _act(actions, 'destroy', pool.destroy)
+    _act(actions, 'undefine', pool.undefine)
+    return actions
+
+
+def remove_volume(conn, name, volume_pool=None, **options):
+    pool = _lookup(conn.storagePoolLookupByName, volume_pool, libvirt.VIR_ERR_NO_STORAGE_POOL)
+    if pool is None:
+        return []
+    vol = _lookup(pool.storageVolLookupByName, name, libvirt.VIR_ERR_NO_STORAGE_VOL)
+    if vol is None:
+        return []
+    actions = []
+    _act(actions, 'delete', vol.delete, 0)
+    return actions
+
+
+def remove_volumes(conn, names, volume_pool=None, **options):
+    '''Delete many volumes of a pool with a single lookup and listing of
+    the pool. Returns {name: actions}, with the exception instead of the
+    actions for volumes that could not be deleted.'''
+    pool = _lookup(conn.storagePoolLookupByName, volume_pool, libvirt.VIR_ERR_NO_STORAGE_POOL)
+    if pool is None:
+        return dict((name, []) for name in names)
+    present = dict((vol.name(), vol) for vol in pool.listAllVolumes(0))
+    actions = {}
+    for name in names:
+        if name not in present:
+            actions[name] = []
+            continue
+        try:
+            present[name].delete(0)
+            actions[name] = ['delete']
+        except libvirt.libvirtError as e:
+            if _missing(e, libvirt.VIR_ERR_NO_STORAGE_VOL):
+                actions[name] = []
+            else:
+                actions[name] = e
+    return actions
+
+
+def remove_domain(conn, name, **options):
+    dom = _lookup(conn.lookupByName, name, libvirt.VIR_ERR_NO_DOMAIN)
+    if dom is None:
+        return []
+    actions = []
+    if dom.isActive():
+        _act(actions, 'destroy', dom.destroy)
+    _act(actions, 'undefine', dom.undefine)
+    return actions
+
+
+PROVISIONERS = {
+    'networks': ensure_network,
+    'pools': ensure_pool,
+    'volumes': ensure_volume,
+    'domains': ensure_domain,
+}
+
+REMOVERS = {
+    'networks': remove_network,
+    'pools': remove_pool,
+    'volumes': remove_volume,
+    'domains': remove_domain,
+}
+
+
+def topology_graph(topology, volume_pool=None):
+    '''Build the dependency graph of a rendered topology.
+
+    topology maps each kind to {key: xml}. Returns {(kind, key): set of
+    (kind, key)} where a domain depends on the networks its interfaces use
+    and on the volumes backing its disks, and a volume depends on the pool
+    it is created in.'''
+    trees = {}
+    for kind, documents in topology.items():
+        for key, xml in documents.items():
+            try:
+                trees[(kind, key)] = ElementTree.fromstring(to_bytes(xml))
+            except ElementTree.ParseError:
+                trees[(kind, key)] = None
+
+    def index(kind):
+        return dict((tree.findtext('name'), node)
+                    for node, tree in trees.items()
+                    if node[0] == kind and tree is not None)
+
+    networks = index('networks')
+    pools = index('pools')
+    volumes = index('volumes')
+
+    # Disks refer to volumes by path: match on the full path when the
+    # target of the volume pool is known, on the file name otherwise
+    pool_node = pools.get(volume_pool)
+    pool_path = None
+    if pool_node is not None:
+        pool_path = trees[pool_node].findtext('target/path')
+    volume_paths = {}
+    for name, node in volumes.items():
+        if pool_path:
+            volume_paths[pool_path.rstrip('/') + '/' + name] = node
+        else:
+            volume_paths[name] = node
+
+    graph = {}
+    for node, tree in trees.items():
+        deps = graph.setdefault(node, set())
+        if tree is None:
+            continue
+        if node[0] == 'volumes' and pool_node is not None:
+            deps.add(pool_node)
+        elif node[0] == 'domains':
+            for source in tree.iterfind('devices/interface/source'):
+                if source.get('network') in networks:
+                    deps.add(networks[source.get('network')])
+            for source in tree.iterfind('devices/disk/source'):
+                path = source.get('file') or ''
+                if not pool_path:
+                    path = path.rsplit('/', 1)[-1]
+                if path in volume_paths:
+                    deps.add(volume_paths[path])
+    return graph
+
+
+def reverse_graph(graph):
+    '''Invert the edges of a dependency graph, for teardown'''
+    reverse = dict((node, set()) for node in graph)
+    for node, deps in graph.items():
+        for dep in deps:
+            reverse.setdefault(dep, set()).add(node)
+    return reverse
+
+
+def run_graph(pool, jobs, graph, workers):
+    '''Run jobs as soon as their dependencies are done.
+
+    jobs is a list of ((kind, key), func) where func takes a libvirt
+    connection and returns the list of actions performed; graph maps each
+    node to the set of nodes it waits for. At most `workers` jobs run at the
+    same time. Jobs whose dependencies failed are not run and reported as
+    failed. Returns one result dict per job, in the order of jobs, with
+    the seconds spent in each libvirt call of the job in `timings`.'''
+    funcs = dict(jobs)
+    waiting = dict((node, set(dep for dep in graph.get(node, ()) if dep in funcs))
+                   for node in funcs)
+    dependents = dict((node, []) for node in funcs)
+    for node, deps in waiting.items():
+        for dep in deps:
+            dependents[dep].append(node)
+
+    results = {}
+    ready = queue.Queue()
+    lock = threading.Lock()
+    origin = time.time()
+    workers = max(1, min(workers, len(jobs)))
+
+    for node, func in jobs:
+        if not waiting[node]:
+            ready.put(node)
+    if not jobs:
+        return []
+
+    def finish(node, result):
+        with lock:
+            results[node] = result
+            for child in dependents[node]:
+                waiting[child].discard(node)
+                if not waiting[child]:
+                    ready.put(child)
+            if len(results) == len(funcs):
+                for dummy in range(workers):
+                    ready.put(None)
+
+    def worker():
+        while True:
+            node = ready.get()
+            if node is None:
+                return
+            kind, key = node
+            result = {'kind': kind, 'key': key, 'changed': False,
+                      'failed': False, 'actions': [], 'timings': {}}
+            blocked = sorted('%s/%s' % dep for dep in graph.get(node, ())
+                             if dep in results and results[dep]['failed'])
+            start = time.time()
+            result['started'] = round(start - origin, 6)
+            conn = None
+            try:
+                if blocked:
+                    raise Exception('dependency failed: %s' % ', '.join(blocked))
+                conn = pool.acquire()
+                _TIMINGS.value = result['timings']
+                result['actions'] = funcs[node](conn)
+                result['changed'] = bool(result['actions'])
+            except Exception as e:
+                result['failed'] = True
+                result['msg'] = to_native(e)
+            finally:
+                _TIMINGS.value = None
+                if conn is not None:
+                    pool.release(conn)
+            result['elapsed'] = round(time.time() - start, 6)
+            finish(node, result)
+
+    threads = [threading.Thread(target=worker) for dummy in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return [results[node] for node, func in jobs]
+
+
+# Teardown order when only names are known: domains release networks and
+# volumes, volumes release their pool
+TEARDOWN_STAGES = (('domains',), ('networks', 'volumes'), ('pools',))
+
+
+def _remover(func, *args, **options):
+    return lambda conn: func(conn, *args, **options)
+
+
+def teardown(pool, names, workers, volume_pool=None):
+    '''Remove objects known by name only, stage by stage.
+
+    names maps each kind to a list of names. Objects of a stage are removed
+    concurrently by at most `workers` threads, volumes in one batch per
+    worker. Objects already absent are reported unchanged. Returns one
+    result dict per object, like run_graph.'''
+    results = []
+    for stage in TEARDOWN_STAGES:
+        jobs = []
+        batches = {}
+        for kind in stage:
+            kind_names = sorted(set(names.get(kind) or []))
+            if kind == 'volumes':
+                for index in range(min(workers, len(kind_names))):
+                    batches[index] = kind_names[index::workers]
+                    jobs.append((('volumes', index),
+                                 _remover(remove_volumes, batches[index],
+                                          volume_pool=volume_pool)))
+            else:
+                jobs.extend(((kind, name), _remover(REMOVERS[kind], name))
+                            for name in kind_names)
+
+        for result in run_graph(pool, jobs, {}, workers):
+            if result['kind'] != 'volumes':
+                results.append(result)
+                continue
+            outcome = result.pop('actions') or {}
+            for name in batches[result['key']]:
+                item = dict(result, key=name)
+                actions = outcome.get(name, [])
+                if isinstance(actions, Exception):
+                    item.update(failed=True, msg=to_native(actions), actions=[])
+                else:
+                    item.update(actions=actions, changed=bool(actions))
+                results.append(item)
+    return results
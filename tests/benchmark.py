@@ -0,0 +1,289 @@
+#!/usr/bin/env python
+# (c) 2018, Victor da Costa <victorockeiro@gmail.com>
+#
+# This file is part of Ansible
+#
+# Ansible is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Ansible is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Ansible.  If not, see <http://www.gnu.org/licenses/>.
+'''
+Benchmark the XML filters and the provisioning pipeline at scale.
+
+Synthetic leaf/spine topologies shaped like vars/main.yml are generated
+from the node template of tests/vars/spec.yml, for every size given with
+--sizes (10, 100, 1000 and 10000 nodes by default). For each of them:
+
+  render    topology_to_xml with a cold and a warm render cache, per engine
+  parse     from_xml of every rendered document, per engine
+  create    virt_topology bring-up against libvirt (test:///default)
+  destroy   names-only teardown against the same connection
+
+The render cache holds every document of the topology unless --cache-size
+is given; the warm runs report their hit ratio next to their timings, a
+cache smaller than the topology evicts documents before they are reused.
+
+Wall time, throughput (documents per second) and peak Python memory are
+reported as JSON, on stdout or in --output, so runs of two releases can be
+compared. Memory is measured in a separate pass with tracemalloc, so it
+does not inflate the timings; the render memory pass uses one process.
+
+    python tests/benchmark.py --sizes 10,100 --output before.json
+'''
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import argparse
+import copy
+import gc
+import json
+import os
+import platform
+import resource
+import sys
+import time
+import tracemalloc
+
+import yaml
+
+from unit import ROOT, load
+
+xml_filters = load('darkbulb_xml', 'filter_plugins/xml.py')
+topology_filters = load('darkbulb_topology', 'filter_plugins/topology.py')
+virt = load('darkbulb_virt', 'module_utils/darkbulb_virt.py')
+
+
+def synthetic_spec(nodes):
+    '''Compact specification of a leaf/spine lab of `nodes` nodes
+
+    One spine every 16 nodes (at least 2), every leaf is linked to two
+    spines and leaves are linked in pairs, like the default lab.'''
+    with open(os.path.join(ROOT, 'tests', 'vars', 'spec.yml')) as f:
+        spec = copy.deepcopy(yaml.safe_load(f)['darkbulb_topology_spec'])
+    spines = max(2, nodes // 16)
+    leaves = max(1, nodes - spines)
+    width = len(str(max(leaves, spines)))
+
+    names = dict(leaf=['leaf%0*d' % (width, i) for i in range(1, leaves + 1)],
+                 spine=['spine%0*d' % (width, i) for i in range(1, spines + 1)])
+    spec['nodes'] = {}
+    for serial, name in enumerate(names['leaf'] + names['spine'], 1):
+        spec['nodes'][name] = {'template': 'ios', 'vars': {
+            'mac': '52:54:02:%02x:%02x:%02x' % (serial >> 16, (serial >> 8) & 0xff, serial & 0xff)}}
+
+    ports = dict((name, 0) for name in names['spine'])
+
+    def spine_port(spine):
+        ports[spine] += 1
+        return '%s:gig%02d' % (spine, ports[spine])
+
+    spec['links'] = []
+    for i, leaf in enumerate(names['leaf']):
+        for uplink in range(2):
+            spine = names['spine'][(i + uplink) % spines]
+            spec['links'].append(['%s:gig%02d' % (leaf, uplink + 1), spine_port(spine)])
+        if i % 2:
+            spec['links'].append(['%s:gig03' % names['leaf'][i - 1], '%s:gig03' % leaf])
+    return spec
+
+
+def synthetic_topology(nodes):
+    with open(os.path.join(ROOT, 'vars', 'main.yml')) as f:
+        base = yaml.safe_load(f)['__darkbulb_topology']
+    return topology_filters.expand_topology(synthetic_spec(nodes), base, lazy=False)
+
+
+def timed(func, repeat):
+    '''Best wall time of `repeat` calls, with the result of the last one'''
+    best = None
+    for dummy in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def peak_memory(func):
+    '''Peak of the Python allocations made by func, in bytes'''
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def count(documents):
+    return sum(len(section) for section in documents.values())
+
+
+def bench_render(topology, engine, repeat, memory):
+    cache = xml_filters._RENDER_CACHE
+
+    def cold():
+        cache.clear()
+        return xml_filters.topology_to_xml(topology, engine=engine)
+
+    cold_time, documents = timed(cold, repeat)
+    before = cache.info()
+    warm_time, dummy = timed(lambda: xml_filters.topology_to_xml(topology, engine=engine), repeat)
+    after = cache.info()
+    hits = after['hits'] - before['hits']
+    lookups = hits + after['misses'] - before['misses']
+    total = count(documents)
+    result = {'documents': total,
+              'bytes': sum(len(xml) for section in documents.values() for xml in section.values()),
+              'cache_maxsize': cache.maxsize,
+              'cold_seconds': round(cold_time, 6),
+              'cold_docs_per_second': round(total / cold_time, 1),
+              'warm_seconds': round(warm_time, 6),
+              'warm_docs_per_second': round(total / warm_time, 1),
+              'warm_hit_ratio': round(hits / lookups, 4) if lookups else None,
+              'warm_evictions': after['evictions'] - before['evictions']}
+    if memory:
+        def single():
+            xml_filters._RENDER_CACHE.clear()
+            xml_filters.topology_to_xml(topology, engine=engine, processes=1)
+        result['peak_bytes'] = peak_memory(single)
+    return result, documents
+
+
+def bench_parse(documents, engine, repeat, memory):
+    texts = [xml for section in documents.values() for xml in section.values()]
+
+    def parse():
+        return [xml_filters.from_xml(xml, native=True, engine=engine) for xml in texts]
+
+    elapsed, dummy = timed(parse, repeat)
+    result = {'documents': len(texts),
+              'seconds': round(elapsed, 6),
+              'docs_per_second': round(len(texts) / elapsed, 1)}
+    if memory:
+        result['peak_bytes'] = peak_memory(parse)
+    return result
+
+
+def test_driver_documents(topology, engine):
+    '''Rendered documents with the domains switched to the test driver'''
+    topology = dict(topology)
+    topology['domains'] = dict(
+        (name, {'domain': dict(document['domain'], **{'@type': 'test'})})
+        for name, document in topology['domains'].items())
+    return xml_filters.topology_to_xml(topology, engine=engine)
+
+
+def provisioner(kind, xml, volume_pool):
+    return lambda conn: virt.PROVISIONERS[kind](conn, xml, volume_pool=volume_pool)
+
+
+def bench_libvirt(topology, engine, uri, workers):
+    documents = test_driver_documents(topology, engine)
+    volume_pool = topology['pools']['default']['pool']['name']
+    pool = virt.ConnectionPool(uri, workers)
+    try:
+        graph = virt.topology_graph(documents, volume_pool)
+        jobs = [((kind, key), provisioner(kind, xml, volume_pool))
+                for kind in xml_filters.TOPOLOGY_KINDS
+                for key, xml in sorted(documents[kind].items())]
+        start = time.perf_counter()
+        created = virt.run_graph(pool, jobs, graph, workers)
+        create_time = time.perf_counter() - start
+
+        names = dict((kind, [virt.xml_name(xml) for xml in section.values()])
+                     for kind, section in documents.items())
+        start = time.perf_counter()
+        removed = virt.teardown(pool, names, workers, volume_pool)
+        destroy_time = time.perf_counter() - start
+    finally:
+        pool.close()
+    return {'objects': len(jobs),
+            'workers': workers,
+            'create_seconds': round(create_time, 6),
+            'create_failed': sum(1 for result in created if result['failed']),
+            'destroy_seconds': round(destroy_time, 6),
+            'destroy_failed': sum(1 for result in removed if result['failed'])}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--sizes', default='10,100,1000,10000',
+                        help='comma separated node counts (default: %(default)s)')
+    parser.add_argument('--engines', default=','.join(xml_filters.xml_engines()),
+                        help='comma separated XML engines (default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='runs per measure, the best one is kept (default: %(default)s)')
+    parser.add_argument('--uri', default='test:///default',
+                        help='libvirt uri of the create/destroy benchmark (default: %(default)s)')
+    parser.add_argument('--workers', type=int, default=8,
+                        help='virt_topology workers (default: %(default)s)')
+    parser.add_argument('--cache-size', type=int,
+                        help='entries of the render cache (default: the documents of each topology)')
+    parser.add_argument('--no-memory', action='store_true',
+                        help='skip the tracemalloc passes')
+    parser.add_argument('--no-libvirt', action='store_true',
+                        help='skip the create/destroy benchmark')
+    parser.add_argument('--output', help='write the JSON report to this file')
+    args = parser.parse_args()
+
+    engines = [engine for engine in args.engines.split(',') if engine]
+    report = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'engines': engines,
+        'repeat': args.repeat,
+        'results': [],
+    }
+
+    for nodes in [int(size) for size in args.sizes.split(',') if size]:
+        start = time.perf_counter()
+        topology = synthetic_topology(nodes)
+        entry = {'nodes': len(topology['domains']),
+                 'links': len(synthetic_spec(nodes)['links']),
+                 'generate_seconds': round(time.perf_counter() - start, 6),
+                 'render': {}, 'parse': {}}
+        if args.cache_size is None:
+            xml_filters._RENDER_CACHE.maxsize = sum(
+                len(topology.get(kind) or {}) for kind in xml_filters.TOPOLOGY_KINDS)
+        else:
+            xml_filters._RENDER_CACHE.maxsize = args.cache_size
+        for engine in engines:
+            entry['render'][engine], documents = bench_render(topology, engine, args.repeat,
+                                                              not args.no_memory)
+            entry['parse'][engine] = bench_parse(documents, engine, args.repeat,
+                                                 not args.no_memory)
+
+        if args.no_libvirt:
+            entry['libvirt'] = {'skipped': '--no-libvirt'}
+        elif not virt.HAS_VIRT:
+            entry['libvirt'] = {'skipped': 'libvirt-python is not installed'}
+        else:
+            entry['libvirt'] = bench_libvirt(topology, engines[0], args.uri, args.workers)
+
+        report['results'].append(entry)
+        print('%6d nodes done' % entry['nodes'], file=sys.stderr)
+
+    report['max_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+# Pseudo-terminals standing in for domain serial consoles in consoles.yml.
+#
+# Usage: consoles.py STATE_FILE NAME:DELAY...
+#
+# Opens one pty per NAME, writes its pid to STATE_FILE.pid and {NAME: pty
+# path} to STATE_FILE, then prints a boot banner and an IOS prompt on each
+# console once its DELAY (seconds) has elapsed, and the prompt again on every
+# carriage return after that. Exits after 60 seconds, or once killed.
+import json
+import os
+import pty
+import select
+import sys
+import time
+
+start = time.time()
+consoles = {}
+for arg in sys.argv[2:]:
+    name, delay = arg.split(':')
+    master, slave = pty.openpty()
+    consoles[name] = {'master': master, 'slave': slave, 'delay': float(delay),
+                      'path': os.ttyname(slave), 'booted': False}
+
+with open(sys.argv[1] + '.pid', 'w') as pid:
+    pid.write('%d\n' % os.getpid())
+with open(sys.argv[1] + '.tmp', 'w') as state:
+    json.dump(dict((name, c['path']) for name, c in consoles.items()), state)
+os.rename(sys.argv[1] + '.tmp', sys.argv[1])
+
+while time.time() - start < 60:
+    masters = [c['master'] for c in consoles.values()]
+    readable = select.select(masters, [], [], 0.2)[0]
+    for name, console in consoles.items():
+        # Booted consoles answer the carriage returns of the waiter
+        if console['master'] in readable:
+            if b'\r' in os.read(console['master'], 1024) and console['booted']:
+                os.write(console['master'], b'\r\n%s>' % name.encode())
+        if not console['booted'] and time.time() - start >= console['delay']:
+            console['booted'] = True
+            os.write(console['master'], b'Booting...\r\nPress RETURN to get started!\r\n\r\n%s>' % name.encode())
@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+# Offline stand-in for the libcloud GCE driver of inventory/gce.py.
+#
+# Selected with GCE_LIBCLOUD_DRIVER=/path/to/fake_gce.py, it replays the
+# instances of GCE_FAKE_INSTANCES: a JSON file of instance resources, as
+# returned by the compute API or `gcloud compute instances list
+# --format=json`, or a number of synthetic instances generated from
+# GCE_FAKE_SEED. The aggregated and per zone listings are paginated like
+# the API, GCE_FAKE_LATENCY adds a delay (seconds) to every request.
+#
+# Usage: fake_gce.py [--count N] [--zones N] [--tags N] [--networks N]
+#                    [--seed N] [--output FILE]
+#
+# Writes a fixture of synthetic instances, to replay or to edit.
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+from libcloud.compute.base import Node
+from libcloud.compute.types import NodeState
+
+API = 'https://www.googleapis.com/compute/v1/projects/%s'
+REGIONS = ('us-central1', 'us-east1', 'us-west1', 'europe-west1',
+           'europe-west4', 'asia-east1', 'asia-northeast1', 'australia-southeast1')
+MACHINE_TYPES = ('n1-standard-1', 'n1-standard-2', 'n1-standard-4',
+                 'n1-highmem-8', 'g1-small', 'f1-micro')
+IMAGES = ('debian-9-stretch-v20180611', 'centos-7-v20180611',
+          'ubuntu-1804-bionic-v20180617', None)
+STATUSES = ('RUNNING',) * 18 + ('TERMINATED', 'STOPPING')
+
+# Fixtures are loaded once per process, every connection of gce.py shares them
+_FIXTURES = {}
+
+
+def zone_names(count):
+    return ['%s-%s' % (REGIONS[i % len(REGIONS)], 'abcf'[i // len(REGIONS) % 4])
+            for i in range(count)]
+
+
+def generate_instances(count, zones=8, tags=20, networks=4, seed=0, project='darkbulb'):
+    '''Instance resources of count synthetic instances, spread over zones,
+    networks and tags like a fleet would be'''
+    rand = random.Random(seed)
+    base = API % project
+    zones = zone_names(zones)
+    tags = ['tag%02d' % i for i in range(tags)]
+    instances = []
+    for i in range(count):
+        zone = zones[i % len(zones)]
+        network = 'net%d' % (i % networks)
+        interface = {
+            'network': '%s/global/networks/%s' % (base, network),
+            'subnetwork': '%s/regions/%s/subnetworks/%s-%s' % (base, zone[:-2], network, zone[:-2]),
+            'networkIP': '10.%d.%d.%d' % (i >> 16 & 0xff, i >> 8 & 0xff, i & 0xff),
+        }
+        if rand.random() < 0.3:
+            interface['accessConfigs'] = [{'type': 'ONE_TO_ONE_NAT', 'name': 'External NAT',
+                                           'natIP': '35.%d.%d.%d' % (rand.randint(0, 255),
+                                                                     rand.randint(0, 255),
+                                                                     rand.randint(1, 254))}]
+        instance_tags = rand.sample(tags, rand.randint(0, min(5, len(tags))))
+        if i % 2 == 0:
+            instance_tags.append('darkbulb')
+        image = rand.choice(IMAGES)
+        disk = {'boot': True, 'source': '%s/zones/%s/disks/node%06d' % (base, zone, i)}
+        if image:
+            disk['licenses'] = ['%s/global/licenses/%s' % (base, image)]
+        instances.append({
+            'kind': 'compute#instance',
+            'id': str(10 ** 15 + i),
+            'name': 'node%06d' % i,
+            'description': '',
+            'zone': '%s/zones/%s' % (base, zone),
+            'status': rand.choice(STATUSES),
+            'machineType': '%s/zones/%s/machineTypes/%s' % (base, zone, rand.choice(MACHINE_TYPES)),
+            'tags': {'items': sorted(instance_tags)},
+            'metadata': {'items': [{'key': 'role', 'value': 'node%d' % (i % 7)},
+                                   {'key': 'serial', 'value': str(i)}][:rand.randint(0, 2)]},
+            'networkInterfaces': [interface],
+            'disks': [disk],
+        })
+    return instances
+
+
+def load_instances(source=None, seed=None):
+    '''Instances of a fixture file, or a number of synthetic instances'''
+    if source is None:
+        source = os.environ.get('GCE_FAKE_INSTANCES', '100')
+    if seed is None:
+        seed = int(os.environ.get('GCE_FAKE_SEED', '0'))
+    key = (source, seed)
+    if key not in _FIXTURES:
+        if source.isdigit():
+            _FIXTURES[key] = generate_instances(int(source), seed=seed)
+        else:
+            with open(source) as fixture:
+                _FIXTURES[key] = json.load(fixture)
+    return _FIXTURES[key]
+
+
+def basename(url):
+    return url.rsplit('/', 1)[-1] if url else None
+
+
+class FakeResponse(object):
+    def __init__(self, body):
+        self.object = body
+        self.status = 200
+
+
+class FakeZone(object):
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return '<FakeZone name="%s">' % self.name
+
+
+class FakeGCEConnection(object):
+    '''Answers the instance listings of the compute API from instances'''
+
+    def __init__(self, instances, latency=0):
+        self.instances = instances
+        self.latency = latency
+        self.requests = 0
+        self.zones = {}
+        for instance in instances:
+            self.zones.setdefault(basename(instance['zone']), []).append(instance)
+
+    def user_agent_append(self, token):
+        pass
+
+    def request(self, action, method='GET', params=None, data=None):
+        params = params or {}
+        self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+        path = action.strip('/').split('/')
+        if path == ['aggregated', 'instances']:
+            items = self.instances
+        elif len(path) == 3 and path[0] == 'zones' and path[2] == 'instances':
+            items = self.zones.get(path[1], [])
+        else:
+            raise ValueError('%s %s is not faked' % (method, action))
+
+        start = int(params.get('pageToken', 0))
+        end = start + int(params.get('maxResults', 500))
+        page = items[start:end]
+        if path[0] == 'aggregated':
+            body = {'kind': 'compute#instanceAggregatedList', 'items': {}}
+            for instance in page:
+                scope = body['items'].setdefault('zones/%s' % basename(instance['zone']),
+                                                 {'instances': []})
+                scope['instances'].append(instance)
+        else:
+            body = {'kind': 'compute#instanceList', 'items': page}
+        if end < len(items):
+            body['nextPageToken'] = str(end)
+        return FakeResponse(body)
+
+
+class GCENodeDriver(object):
+    '''libcloud GCE driver replaying instances, as far as gce.py uses it'''
+
+    type = 'gce'
+    name = 'Fake Google Compute Engine'
+    NODE_STATE_MAP = {
+        'PROVISIONING': NodeState.PENDING,
+        'STAGING': NodeState.PENDING,
+        'RUNNING': NodeState.RUNNING,
+        'STOPPING': NodeState.PENDING,
+        'STOPPED': NodeState.STOPPED,
+        'TERMINATED': NodeState.STOPPED,
+        'SUSPENDED': NodeState.SUSPENDED,
+    }
+
+    def __init__(self, user_id='', key=None, project=None, datacenter=None,
+                 instances=None, latency=None, **kwargs):
+        self.project = project
+        self.datacenter = datacenter
+        if instances is None:
+            instances = load_instances()
+        if latency is None:
+            latency = float(os.environ.get('GCE_FAKE_LATENCY', '0'))
+        self.connection = FakeGCEConnection(instances, latency)
+
+    def _ex_populate_volume_dict(self):
+        self._ex_volume_dict = {}
+
+    def _to_node(self, node, use_disk_cache=False):
+        interfaces = node.get('networkInterfaces', [])
+        licenses = node.get('disks', [{}])[0].get('licenses')
+        extra = {
+            'status': node.get('status'),
+            'description': node.get('description'),
+            'zone': FakeZone(basename(node['zone'])),
+            'tags': node.get('tags', {}).get('items', []),
+            'metadata': node.get('metadata', {}),
+            'networkInterfaces': interfaces,
+            'machineType': node.get('machineType'),
+            'disks': node.get('disks', []),
+        }
+        return Node(id=node['id'], name=node['name'],
+                    state=self.NODE_STATE_MAP.get(node.get('status'), NodeState.UNKNOWN),
+                    public_ips=[config['natIP'] for interface in interfaces
+                                for config in interface.get('accessConfigs', [])
+                                if 'natIP' in config],
+                    private_ips=[interface['networkIP'] for interface in interfaces],
+                    driver=self,
+                    size=basename(node.get('machineType')),
+                    image=basename(licenses[-1]) if licenses else None,
+                    extra=extra)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write a fixture of synthetic GCE instances')
+    parser.add_argument('--count', type=int, default=1000)
+    parser.add_argument('--zones', type=int, default=8)
+    parser.add_argument('--tags', type=int, default=20)
+    parser.add_argument('--networks', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='fixture file (default: stdout)')
+    args = parser.parse_args()
+
+    instances = generate_instances(args.count, args.zones, args.tags, args.networks, args.seed)
+    if args.output:
+        with open(args.output, 'w') as fixture:
+            json.dump(instances, fixture, indent=1)
+    else:
+        json.dump(instances, sys.stdout, indent=1)
+
+
+if __name__ == '__main__':
+    main()
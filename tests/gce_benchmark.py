@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+# (c) 2018, Victor da Costa <victorockeiro@gmail.com>
+#
+# This file is part of Ansible
+#
+# Ansible is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Ansible is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Ansible.  If not, see <http://www.gnu.org/licenses/>.
+'''
+Benchmark the GCE inventory build at scale, offline.
+
+The inventory of tests/inventory/gce.py is built from the instances of
+the fake libcloud driver of tests/files/fake_gce.py: synthetic fleets of
+every size given with --sizes (1000, 10000 and 50000 instances by
+default), or the instances of a --fixture file. Every stage is timed:
+
+  listing        paginated API listing and conversion to libcloud nodes
+  filtering      instance_states and instance_tags filters
+  grouping       groups and host variables of the filtered nodes
+  serialisation  JSON of the inventory, compact and --pretty, as one
+                 string and streamed like the script prints it
+
+Wall time, throughput (instances per second) and the peak Python memory
+of the whole build, printed as the script does, are reported as JSON, on
+stdout or in --output.
+Memory is measured in a separate pass with tracemalloc, so it does not
+inflate the timings.
+
+    python tests/gce_benchmark.py --sizes 1000,50000 --tags 200 --output before.json
+'''
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import argparse
+import gc
+import json
+import os
+import platform
+import resource
+import sys
+import time
+import tracemalloc
+
+from unit import load
+
+fake_gce = load('fake_gce', 'tests/files/fake_gce.py')
+gce = load('gce_inventory', 'tests/inventory/gce.py')
+
+
+def timed(func, repeat):
+    '''Best wall time of `repeat` calls, with the result of the last one'''
+    best = None
+    for dummy in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def peak_memory(func):
+    '''Peak of the Python allocations made by func, in bytes'''
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+class Sink(object):
+    '''stdout stand-in counting what is written to it'''
+
+    def __init__(self):
+        self.bytes = 0
+
+    def write(self, text):
+        self.bytes += len(text)
+
+    def flush(self):
+        pass
+
+
+def streamed(groups, pretty):
+    sink = Sink()
+    gce.write_json(groups, pretty, sink)
+    return sink
+
+
+def inventory(instances, args):
+    '''GceInventory reading instances through the fake driver, with the
+    filters and listing options of args and nothing from gce.ini'''
+    os.environ['GCE_INI_PATH'] = os.devnull
+    inv = gce.GceInventory.__new__(gce.GceInventory)
+    inv.args = gce.cli_parser().parse_args([])
+    inv.config = inv.get_config()
+    inv.ip_type = None
+    inv.instance_states = [state for state in args.instance_states.split(',') if state]
+    inv.instance_tags = [tag for tag in args.instance_tags.split(',') if tag]
+    inv.page_size = args.page_size
+    inv.max_connections = args.max_connections
+    # Every zone listing worker gets its own driver
+    inv.drivers = []
+
+    def get_gce_driver():
+        driver = fake_gce.GCENodeDriver(project='benchmark', instances=instances,
+                                        latency=args.latency)
+        inv.drivers.append(driver)
+        return driver
+    inv.get_gce_driver = get_gce_driver
+    return inv
+
+
+def bench(instances, args):
+    inv = inventory(instances, args)
+    zones = args.zones_filter and sorted(set(fake_gce.basename(instance['zone'])
+                                             for instance in instances)) or None
+
+    def listing():
+        del inv.drivers[:]
+        inv.driver = inv.get_gce_driver()
+        return inv.list_nodes(zones)
+
+    listing_time, nodes = timed(listing, args.repeat)
+    requests = sum(driver.connection.requests for driver in inv.drivers)
+    filtering_time, filtered = timed(lambda: list(inv.filter_nodes(nodes)), args.repeat)
+    grouping_time, groups = timed(lambda: inv.group_nodes(filtered, zones), args.repeat)
+    compact_time, compact = timed(lambda: inv.json_format_dict(groups), args.repeat)
+    pretty_time, pretty = timed(lambda: inv.json_format_dict(groups, pretty=True), args.repeat)
+    stream_time, stream = timed(lambda: streamed(groups, False), args.repeat)
+    stream_pretty_time, stream_pretty = timed(lambda: streamed(groups, True), args.repeat)
+
+    def rate(count, seconds):
+        return round(count / seconds, 1) if seconds else None
+
+    result = {
+        'instances': len(instances),
+        'hosts': len(groups['_meta']['hostvars']),
+        'groups': len(groups) - 1,
+        'api_requests': requests,
+        'listing': {'seconds': round(listing_time, 6),
+                    'instances_per_second': rate(len(nodes), listing_time)},
+        'filtering': {'seconds': round(filtering_time, 6),
+                      'instances_per_second': rate(len(nodes), filtering_time)},
+        'grouping': {'seconds': round(grouping_time, 6),
+                     'instances_per_second': rate(len(filtered), grouping_time)},
+        'serialisation': {'seconds': round(compact_time, 6),
+                          'bytes': len(compact),
+                          'pretty_seconds': round(pretty_time, 6),
+                          'pretty_bytes': len(pretty),
+                          'stream_seconds': round(stream_time, 6),
+                          'stream_bytes': stream.bytes,
+                          'stream_pretty_seconds': round(stream_pretty_time, 6),
+                          'stream_pretty_bytes': stream_pretty.bytes},
+        'total_seconds': round(listing_time + filtering_time + grouping_time + stream_time, 6),
+    }
+    if not args.no_memory:
+        result['peak_bytes'] = peak_memory(
+            lambda: streamed(inv.group_instances(zones, listing()), False))
+        # The listing dominates the peak of the build, the serialisation
+        # alone shows what streaming saves
+        serialisation = result['serialisation']
+        serialisation['peak_bytes'] = peak_memory(lambda: inv.json_format_dict(groups))
+        serialisation['stream_peak_bytes'] = peak_memory(lambda: streamed(groups, False))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--sizes', default='1000,10000,50000',
+                        help='comma separated instance counts (default: %(default)s)')
+    parser.add_argument('--fixture',
+                        help='instances to replay instead of synthetic ones, see fake_gce.py')
+    parser.add_argument('--zones', type=int, default=8,
+                        help='zones of the synthetic instances (default: %(default)s)')
+    parser.add_argument('--tags', type=int, default=20,
+                        help='distinct tags of the synthetic instances (default: %(default)s)')
+    parser.add_argument('--networks', type=int, default=4,
+                        help='networks of the synthetic instances (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed of the synthetic instances (default: %(default)s)')
+    parser.add_argument('--instance-states', default='RUNNING',
+                        help='instance_states filter (default: %(default)s)')
+    parser.add_argument('--instance-tags', default='darkbulb',
+                        help='instance_tags filter (default: %(default)s)')
+    parser.add_argument('--zones-filter', action='store_true',
+                        help='list every zone on its own, like GCE_ZONE, instead of the '
+                             'aggregated listing')
+    parser.add_argument('--page-size', type=int, default=500,
+                        help='instances per API page (default: %(default)s)')
+    parser.add_argument('--max-connections', type=int, default=4,
+                        help='concurrent zone listings (default: %(default)s)')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='seconds added to every API request (default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='runs per measure, the best one is kept (default: %(default)s)')
+    parser.add_argument('--no-memory', action='store_true',
+                        help='skip the tracemalloc pass')
+    parser.add_argument('--output', help='write the JSON report to this file')
+    args = parser.parse_args()
+
+    report = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'repeat': args.repeat,
+        'options': dict((key, value) for key, value in vars(args).items()
+                        if key not in ('output', 'sizes')),
+        'results': [],
+    }
+
+    if args.fixture:
+        fleets = [fake_gce.load_instances(args.fixture)]
+    else:
+        fleets = (fake_gce.generate_instances(int(size), args.zones, args.tags,
+                                              args.networks, args.seed)
+                  for size in args.sizes.split(',') if size)
+    for instances in fleets:
+        report['results'].append(bench(instances, args))
+        print('%6d instances done' % len(instances), file=sys.stderr)
+
+    report['max_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -69,6 +69,9 @@ Examples:
   Use the GCE inventory script to print out instance specific information
   $ contrib/inventory/gce.py --host my_instance
 
+  Serve the inventory from memory, later runs of gce.py ask the daemon
+  $ GCE_INVENTORY_SOCKET=~/.ansible/tmp/ansible-gce.sock contrib/inventory/gce.py --daemon
+
 Author: Eric Johnson <erjohnso@google.com>
 Contributors: Matt Hite <mhite@hotmail.com>, Tom Melendez <supertom@google.com>
 Version: 0.0.3
@@ -89,13 +92,24 @@ USER_AGENT_VERSION = "v2"
 import sys
 import os
 import argparse
+import hashlib
+import mmap
+import signal
+import socket
+import struct
+import tempfile
+import threading
 
-from time import time
+from time import time, sleep
 
 if sys.version_info >= (3, 0):
     import configparser
+    import queue
+    import socketserver
 else:
     import ConfigParser as configparser
+    import Queue as queue
+    import SocketServer as socketserver
 
 import logging
 logging.getLogger('libcloud.common.google').addHandler(logging.NullHandler())
@@ -105,57 +119,409 @@ try:
 except ImportError:
     import simplejson as json
 
+
+def cli_parser():
+    ''' Command line arguments, shared by the inventory and its client '''
+    parser = argparse.ArgumentParser(
+        description='Produce an Ansible Inventory file based on GCE')
+    parser.add_argument('--list', action='store_true', default=True,
+                        help='List instances (default: True)')
+    parser.add_argument('--host', action='store',
+                        help='Get all information about an instance')
+    parser.add_argument('--instance-tags', action='store',
+                        help='Only include instances with this tags, separated by comma')
+    parser.add_argument('--pretty', action='store_true', default=False,
+                        help='Pretty format (default: False)')
+    parser.add_argument(
+        '--refresh-cache', action='store_true', default=False,
+        help='Force refresh of cache by making API requests (default: False - use cache files)')
+    parser.add_argument(
+        '--daemon', action='store_true', default=False,
+        help='Serve the inventory on the daemon socket, refreshing it in the background')
+    parser.add_argument(
+        '--socket', action='store',
+        help='Daemon socket (default: GCE_INVENTORY_SOCKET or daemon_socket of gce.ini)')
+    return parser
+
+
+def gce_ini_path():
+    gce_ini_default_path = os.path.join(
+        os.path.dirname(os.path.realpath(__file__)), "gce.ini")
+    return os.environ.get('GCE_INI_PATH', gce_ini_default_path)
+
+
+def parse_zones(value):
+    ''' Returns the list of comma separated zones of value '''
+    import csv
+    reader = csv.reader([value], skipinitialspace=True)
+    zones = [r for r in reader]
+    return [z for z in zones[0]]
+
+
+# Seconds the client waits for the daemon by default, a daemon that does not
+# answer in time (hung, or refreshing for longer) is bypassed
+DAEMON_TIMEOUT = 10
+
+
+def daemon_option(name, env, default=None):
+    ''' Daemon setting of the environment variable env, or of name in the
+    cache section of gce.ini '''
+    value = os.environ.get(env)
+    if value is None:
+        config = configparser.RawConfigParser()
+        config.read(gce_ini_path())
+        if config.has_option('cache', name):
+            value = config.get('cache', name)
+    return default if value is None else value
+
+
+def daemon_socket(args):
+    ''' Path of the daemon socket, None when the daemon is not used '''
+    if args.socket:
+        return os.path.expanduser(args.socket)
+    path = daemon_option('daemon_socket', 'GCE_INVENTORY_SOCKET')
+    return os.path.expanduser(path) if path else None
+
+
+def daemon_timeout():
+    ''' Seconds the client waits for the daemon before building the
+    inventory itself '''
+    try:
+        return float(daemon_option('daemon_timeout', 'GCE_INVENTORY_TIMEOUT',
+                                   DAEMON_TIMEOUT))
+    except ValueError:
+        return DAEMON_TIMEOUT
+
+
+def inventory_client(args):
+    ''' Asks the inventory daemon for the output of args and prints it.
+    Returns False when the daemon can not answer, or not within
+    daemon_timeout seconds, the inventory is then built by this process. '''
+    path = daemon_socket(args)
+    if not path or args.daemon or args.instance_tags:
+        return False
+
+    request = {'pretty': args.pretty,
+               'refresh': args.refresh_cache,
+               'zones': parse_zones(os.environ.get('GCE_ZONE', ''))}
+    if args.host:
+        request['host'] = args.host
+
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.settimeout(daemon_timeout())
+    try:
+        client.connect(path)
+        client.sendall(json.dumps(request).encode('utf-8') + b'\n')
+        reply = client.makefile('rb')
+        status = reply.readline().split()
+        if len(status) != 2 or status[0] != b'OK':
+            return False
+        length = int(status[1])
+        document = reply.read(length)
+        if len(document) != length:
+            return False
+    except (socket.error, ValueError):
+        return False
+    finally:
+        client.close()
+
+    out = getattr(sys.stdout, 'buffer', sys.stdout)
+    out.write(document + b'\n')
+    out.flush()
+    return True
+
+
+# Thin client: when the inventory daemon answers, libcloud is not even
+# imported
+if __name__ == '__main__' and inventory_client(cli_parser().parse_args()):
+    sys.exit(0)
+
 try:
     from libcloud.compute.types import Provider
     from libcloud.compute.providers import get_driver
+    from libcloud.common.google import ResourceNotFoundError
     _ = Provider.GCE
 except:
     sys.exit("GCE inventory script requires libcloud >= 0.13")
 
 
+# Index of an inventory: a header, a hash table of slots locating the
+# variables of each host, the host records and the groups. The host records
+# are the members of the hostvars object, separated by commas.
+INDEX_MAGIC = b'GCEINDX1'
+# magic, slots, records offset, groups offset, groups length, expiry time
+INDEX_HEADER = struct.Struct('<8sQQQQd')
+# host name hash (0 when empty), record offset, record length
+INDEX_SLOT = struct.Struct('<QQI')
+
+# The daemon refreshes its inventory this many seconds before it expires,
+# and at most every DAEMON_MIN_REFRESH seconds
+DAEMON_REFRESH_MARGIN = 30
+DAEMON_MIN_REFRESH = 30
+
+
+# Members of an object encoded at once by json_chunks, a group or host
+# counting for each of its hosts or variables, and characters written to
+# stdout at once by write_json
+JSON_BATCH = 256
+JSON_BUFFER = 65536
+
+
+def json_dumps(data, pretty=False, level=0):
+    ''' json.dumps of data, indented for nesting level when pretty '''
+    if not pretty:
+        return json.dumps(data)
+    return json.dumps(data, sort_keys=True, indent=2,
+                      separators=(',', ': ')).replace('\n', '\n' + '  ' * level)
+
+
+def json_chunks(data, pretty=False, depth=3, level=0):
+    ''' Yields data as JSON text, a few members at a time down to depth
+    levels of objects: the groups, then _meta and the hosts of hostvars.
+    The output is the one of json.dumps(data), with sorted keys and
+    indent=2 when pretty. '''
+    if not isinstance(data, dict) or depth == 0 or not data:
+        yield json_dumps(data, pretty, level)
+        return
+
+    separator = ',' if pretty else ', '
+    indent = '\n' + '  ' * (level + 1) if pretty else ''
+    batch = []
+    weight = 0
+
+    def members():
+        # Consecutive members are encoded as one object, without its braces
+        text = json_dumps(dict((key, data[key]) for key in batch), pretty, level)
+        del batch[:]
+        return text[1:text.rindex('\n')] if pretty else text[1:-1]
+
+    yield '{'
+    written = False
+    for key in (sorted(data) if pretty else data):
+        value = data[key]
+        if depth > 1 and isinstance(value, dict) and value:
+            if batch:
+                yield (separator if written else '') + members()
+                written = True
+            yield (separator if written else '') + indent + json.dumps(key) + ': '
+            for chunk in json_chunks(value, pretty, depth - 1, level + 1):
+                yield chunk
+            written = True
+            continue
+        batch.append(key)
+        weight += len(value) if isinstance(value, (dict, list, tuple)) else 1
+        if weight >= JSON_BATCH:
+            yield (separator if written else '') + members()
+            written = True
+            weight = 0
+    if batch:
+        yield (separator if written else '') + members()
+    yield '\n' + '  ' * level + '}' if pretty else '}'
+
+
+def write_json(data, pretty=False, out=None):
+    ''' Writes data as JSON to out, stdout by default, without holding
+    the whole document in memory '''
+    out = out or sys.stdout
+    buffered = []
+    size = 0
+    for chunk in json_chunks(data, pretty):
+        buffered.append(chunk)
+        size += len(chunk)
+        if size >= JSON_BUFFER:
+            out.write(''.join(buffered))
+            del buffered[:]
+            size = 0
+    buffered.append('\n')
+    out.write(''.join(buffered))
+    out.flush()
+
+
+def host_hash(name):
+    # The high bit is set so that no host hashes to an empty slot
+    digest = hashlib.sha1(name.encode('utf-8')).digest()[:8]
+    return struct.unpack('<Q', digest)[0] | (1 << 63)
+
+
+class InventoryIndex(object):
+    ''' Inventory index read through mmap: looking up a host reads its
+    slots and its record only '''
+
+    def __init__(self, filename):
+        with open(filename, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, self.slots, self.records_offset, self.groups_offset,
+         self.groups_length, self.expires) = INDEX_HEADER.unpack_from(self.map, 0)
+        if magic != INDEX_MAGIC:
+            self.close()
+            raise ValueError('%s is not an inventory index' % filename)
+
+    def host(self, name):
+        ''' Returns the variables of host name, KeyError if it is unknown '''
+        wanted = host_hash(name)
+        slot = wanted % self.slots
+        while True:
+            key, offset, length = INDEX_SLOT.unpack_from(
+                self.map, INDEX_HEADER.size + slot * INDEX_SLOT.size)
+            if not key:
+                raise KeyError(name)
+            if key == wanted:
+                record = json.loads(b'{' + self.map[offset:offset + length] + b'}')
+                if name in record:
+                    return record[name]
+            slot = (slot + 1) % self.slots
+
+    def chunks(self, stats):
+        ''' Yields the inventory as JSON, without decoding it '''
+        groups = self.map[self.groups_offset:self.groups_offset + self.groups_length]
+        yield groups[:-1]
+        if len(groups) > 2:
+            yield b', '
+        yield b'"_meta": {"hostvars": {'
+        yield self.map[self.records_offset:self.groups_offset]
+        yield b'}, "stats": ' + json.dumps(stats).encode('utf-8') + b'}}'
+
+    def close(self):
+        self.map.close()
+
+
 class CloudInventoryCache(object):
+    ''' Inventory cache split in shards, one JSON file each in the cache
+    directory, expiring independently from each other '''
+
     def __init__(self, cache_name='ansible-cloud-cache', cache_path='/tmp',
                  cache_max_age=300):
         cache_dir = os.path.expanduser(cache_path)
-        if not os.path.exists(cache_dir):
-            os.makedirs(cache_dir)
         self.cache_path_cache = os.path.join(cache_dir, cache_name)
+        try:
+            os.makedirs(self.cache_path_cache)
+        except OSError:
+            # Created meanwhile by a concurrent run
+            if not os.path.isdir(self.cache_path_cache):
+                raise
 
         self.cache_max_age = cache_max_age
 
-    def is_valid(self, max_age=None):
-        ''' Determines if the cache files have expired, or if it is still valid '''
+    def shard_path(self, shard):
+        return os.path.join(self.cache_path_cache, '%s.json' % shard)
+
+    def is_valid(self, shard, max_age=None):
+        ''' Determines if the cache shard has expired, or if it is still valid '''
 
         if max_age is None:
             max_age = self.cache_max_age
 
-        if os.path.isfile(self.cache_path_cache):
-            mod_time = os.path.getmtime(self.cache_path_cache)
+        filename = self.shard_path(shard)
+        if os.path.isfile(filename):
+            mod_time = os.path.getmtime(filename)
             current_time = time()
             if (mod_time + max_age) > current_time:
                 return True
 
         return False
 
-    def get_all_data_from_cache(self, filename=''):
-        ''' Reads the JSON inventory from the cache file. Returns Python dictionary. '''
-
-        data = ''
-        if not filename:
-            filename = self.cache_path_cache
-        with open(filename, 'r') as cache:
-            data = cache.read()
-        return json.loads(data)
-
-    def write_to_cache(self, data, filename=''):
-        ''' Writes data to file as JSON.  Returns True. '''
-        if not filename:
-            filename = self.cache_path_cache
-        json_data = json.dumps(data)
-        with open(filename, 'w') as cache:
-            cache.write(json_data)
+    def get_all_data_from_cache(self, shard):
+        ''' Reads the JSON data of a cache shard. Returns Python dictionary. '''
+
+        with open(self.shard_path(shard), 'r') as cache:
+            return json.loads(cache.read())
+
+    def write_atomic(self, filename, chunks):
+        ''' Writes chunks to a temporary file and renames it to filename,
+        so concurrent runs never read a partial file '''
+        fd, tmp = tempfile.mkstemp(dir=self.cache_path_cache,
+                                   prefix='.%s.' % os.path.basename(filename))
+        try:
+            with os.fdopen(fd, 'wb') as cache:
+                for chunk in chunks:
+                    cache.write(chunk)
+            os.rename(tmp, filename)
+        except:
+            os.unlink(tmp)
+            raise
+
+    def write_to_cache(self, data, shard):
+        ''' Writes data to a cache shard as JSON. Returns True. '''
+        self.write_atomic(self.shard_path(shard),
+                          (chunk.encode('utf-8') for chunk in json_chunks(data)))
         return True
 
+    def index_path(self, index):
+        return os.path.join(self.cache_path_cache, '%s.idx' % index)
+
+    def write_index(self, inventory, index, expires):
+        ''' Writes inventory as an index, valid until the expires time '''
+        hostvars = inventory['_meta']['hostvars']
+        slots = 2 * len(hostvars) + 1
+        table = [(0, 0, 0)] * slots
+        records = []
+        offset = records_offset = INDEX_HEADER.size + slots * INDEX_SLOT.size
+        for name in sorted(hostvars):
+            if records:
+                records.append(b', ')
+                offset += 2
+            record = json.dumps({name: hostvars[name]}).encode('utf-8')[1:-1]
+            slot = host_hash(name) % slots
+            while table[slot][0]:
+                slot = (slot + 1) % slots
+            table[slot] = (host_hash(name), offset, len(record))
+            records.append(record)
+            offset += len(record)
+        groups = json.dumps(dict((group, hosts) for group, hosts in inventory.items()
+                                 if group != '_meta')).encode('utf-8')
+
+        header = INDEX_HEADER.pack(INDEX_MAGIC, slots, records_offset, offset,
+                                   len(groups), expires)
+        self.write_atomic(self.index_path(index),
+                          [header, b''.join(INDEX_SLOT.pack(*slot) for slot in table)] +
+                          records + [groups])
+
+    def open_index(self, index):
+        ''' Returns the InventoryIndex of index, None when it is missing or
+        expired '''
+        try:
+            opened = InventoryIndex(self.index_path(index))
+        except (IOError, OSError, ValueError, struct.error):
+            return None
+        if opened.expires <= time():
+            opened.close()
+            return None
+        return opened
+
+    def remove(self, shard):
+        try:
+            os.unlink(self.shard_path(shard))
+        except OSError:
+            pass
+
+
+class InventoryRequestHandler(socketserver.StreamRequestHandler):
+    ''' One request of inventory_client: a JSON line, answered with an
+    "OK <length>" or "ERR <message>" line and the document '''
+
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            # Probe of a starting daemon
+            return
+        try:
+            request = json.loads(line.decode('utf-8'))
+            reply = [self.server.inventory.daemon_reply(request)]
+            reply.insert(0, ('OK %d\n' % len(reply[0])).encode('utf-8'))
+        except Exception as e:
+            message = ' '.join(str(e).split()) or e.__class__.__name__
+            reply = [('ERR %s\n' % message).encode('utf-8')]
+        try:
+            for chunk in reply:
+                self.wfile.write(chunk)
+        except socket.error:
+            # The client went away
+            pass
+
+
+class InventoryServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
 
 class GceInventory(object):
     def __init__(self):
@@ -167,37 +533,162 @@ class GceInventory(object):
         # Read settings and parse CLI arguments
         self.parse_cli_args()
         self.config = self.get_config()
-        self.driver = self.get_gce_driver()
+        # The driver authenticates on creation, it is only created when the
+        # cache can not answer
+        self.driver = None
         self.ip_type = self.get_inventory_options()
         if self.ip_type:
             self.ip_type = self.ip_type.lower()
 
-        # Cache management
+        # Cache management, one cache directory per project
+        self.cache = CloudInventoryCache(cache_path=self.cache_path,
+                                         cache_max_age=self.cache_max_age,
+                                         cache_name='ansible-gce-%s' % self.get_gce_params()[1]['project'])
+
+        if self.args.daemon:
+            self.serve(daemon_socket(self.args))
+            sys.exit(0)
         start_inventory_time = time()
-        cache_used = False
-        if self.args.refresh_cache or not self.cache.is_valid():
-            self.do_api_calls_update_cache()
+        zones = self.parse_env_zones()
+        index_name = self.index_name(zones)
+        index = None
+        if not self.args.refresh_cache:
+            index = self.cache.open_index(index_name)
+        if index is None:
+            refreshed, cache_used, expires = self.update_inventory(zones,
+                                                                   self.args.refresh_cache)
+            if self.cache_max_age:
+                self.cache.write_index(self.inventory, index_name, expires)
         else:
-            self.load_inventory_from_cache()
-            cache_used = True
-            self.inventory['_meta']['stats'] = {'use_cache': True}
-        self.inventory['_meta']['stats'] = {
+            # Served by the index, no shard is read
+            refreshed, cache_used = [], True
+        stats = {
             'inventory_load_time': time() - start_inventory_time,
-            'cache_used': cache_used
+            'cache_used': cache_used,
+            'refreshed_zones': refreshed
         }
 
-        # Just display data for specific host
-        if self.args.host:
-            print(self.json_format_dict(
-                self.inventory['_meta']['hostvars'][self.args.host],
-                pretty=self.args.pretty))
-        else:
-            # Otherwise, assume user wants all instances grouped
-            zones = self.parse_env_zones()
-            print(self.json_format_dict(self.inventory,
-                                        pretty=self.args.pretty))
+        try:
+            # Just display data for specific host
+            if self.args.host:
+                if index is None:
+                    hostvars = self.inventory['_meta']['hostvars'][self.args.host]
+                else:
+                    hostvars = index.host(self.args.host)
+                write_json(hostvars, pretty=self.args.pretty)
+            # Otherwise, assume user wants all instances grouped, streamed
+            # group by group
+            elif index is None:
+                self.inventory['_meta']['stats'] = stats
+                write_json(self.inventory, pretty=self.args.pretty)
+            elif self.args.pretty:
+                self.inventory = json.loads(b''.join(index.chunks(stats)).decode('utf-8'))
+                write_json(self.inventory, pretty=True)
+            else:
+                sys.stdout.flush()
+                out = getattr(sys.stdout, 'buffer', sys.stdout)
+                for chunk in index.chunks(stats):
+                    out.write(chunk)
+                out.write(b'\n')
+                out.flush()
+        finally:
+            if index is not None:
+                index.close()
         sys.exit(0)
 
+    def serve(self, path):
+        ''' Serves the inventory on the unix socket path until SIGTERM or
+        SIGINT, from memory. The inventory is refreshed in the background
+        before the cache expires. '''
+        if not path:
+            sys.exit("--daemon requires a socket: --socket, GCE_INVENTORY_SOCKET "
+                     "or daemon_socket in gce.ini")
+
+        self.zones = self.parse_env_zones()
+        self.refresh_lock = threading.Lock()
+        self.refresh_daemon(self.args.refresh_cache)
+
+        if os.path.exists(path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(path)
+                sys.exit("An inventory daemon already serves %s" % path)
+            except socket.error:
+                # Left behind by a daemon that was killed
+                os.unlink(path)
+            finally:
+                probe.close()
+
+        # The inventory is only readable by the owner of the daemon
+        umask = os.umask(0o177)
+        try:
+            server = InventoryServer(path, InventoryRequestHandler)
+        finally:
+            os.umask(umask)
+        server.inventory = self
+
+        def terminate(signum, frame):
+            sys.exit(0)
+        signal.signal(signal.SIGTERM, terminate)
+
+        refresher = threading.Thread(target=self.refresh_loop)
+        refresher.daemon = True
+        refresher.start()
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            os.unlink(path)
+
+    def refresh_daemon(self, refresh):
+        ''' Loads the inventory served by the daemon, with the API when
+        refresh is set, the cache otherwise '''
+        with self.refresh_lock:
+            start_inventory_time = time()
+            refreshed, cache_used, expires = self.update_inventory(self.zones, refresh)
+            if self.cache_max_age:
+                self.cache.write_index(self.inventory, self.index_name(self.zones), expires)
+            self.inventory['_meta']['stats'] = {
+                'inventory_load_time': time() - start_inventory_time,
+                'cache_used': cache_used,
+                'refreshed_zones': refreshed,
+                'daemon': True
+            }
+            # Replaced at once, requests being served keep the previous one
+            self.served = (self.inventory,
+                           self.json_format_dict(self.inventory).encode('utf-8'))
+            self.next_refresh = min(expires, time() + self.cache_max_age) - DAEMON_REFRESH_MARGIN
+            self.next_refresh = max(self.next_refresh, time() + DAEMON_MIN_REFRESH)
+
+    def refresh_loop(self):
+        while True:
+            sleep(max(1, self.next_refresh - time()))
+            if time() < self.next_refresh:
+                continue
+            try:
+                self.refresh_daemon(True)
+            except Exception as e:
+                # Keep serving the previous inventory, try again later
+                sys.stderr.write("Inventory refresh failed: %s\n" % e)
+                self.next_refresh = time() + DAEMON_MIN_REFRESH
+
+    def daemon_reply(self, request):
+        ''' Returns the document answering a request of inventory_client '''
+        if request.get('zones', []) != self.zones:
+            raise ValueError("The daemon serves %s" % (','.join(self.zones) or 'all zones'))
+        if request.get('refresh'):
+            self.refresh_daemon(True)
+
+        inventory, document = self.served
+        if 'host' in request:
+            hostvars = inventory['_meta']['hostvars'][request['host']]
+            return self.json_format_dict(hostvars, pretty=request.get('pretty')).encode('utf-8')
+        if request.get('pretty'):
+            return self.json_format_dict(inventory, pretty=True).encode('utf-8')
+        return document
+
     def get_config(self):
         """
         Reads the settings from the gce.ini file.
@@ -208,9 +699,6 @@ class GceInventory(object):
         not present, the filename defaults to gce.ini in the current
         working directory.
         """
-        gce_ini_default_path = os.path.join(
-            os.path.dirname(os.path.realpath(__file__)), "gce.ini")
-        gce_ini_path = os.environ.get('GCE_INI_PATH', gce_ini_default_path)
 
         # Create a ConfigParser.
         # This provides empty defaults to each key, so that environment
@@ -224,8 +712,11 @@ class GceInventory(object):
             'libcloud_secrets': '',
             'instance_tags': '',
             'inventory_ip_type': '',
+            'max_connections': '4',
+            'page_size': '500',
             'cache_path': '~/.ansible/tmp',
-            'cache_max_age': '300'
+            'cache_max_age': '300',
+            'cache_zones_max_age': '3600'
         })
         if 'gce' not in config.sections():
             config.add_section('gce')
@@ -234,7 +725,7 @@ class GceInventory(object):
         if 'cache' not in config.sections():
             config.add_section('cache')
 
-        config.read(gce_ini_path)
+        config.read(gce_ini_path())
 
         #########
         # Section added for processing ini settings
@@ -258,14 +749,16 @@ class GceInventory(object):
         if self.instance_tags:
             self.instance_tags = self.instance_tags.split(',')
 
-        # Caching
-        cache_path = config.get('cache', 'cache_path')
-        cache_max_age = config.getint('cache', 'cache_max_age')
-        # TOOD(supertom): support project-specific caches
-        cache_name = 'ansible-gce.cache'
-        self.cache = CloudInventoryCache(cache_path=cache_path,
-                                         cache_max_age=cache_max_age,
-                                         cache_name=cache_name)
+        # Zones are listed concurrently over at most max_connections
+        # connections, page_size instances at a time
+        self.max_connections = int(os.environ.get(
+            'GCE_MAX_CONNECTIONS', config.get('gce', 'max_connections')))
+        self.page_size = int(config.get('gce', 'page_size'))
+
+        # Caching, the cache is opened once the project is known
+        self.cache_path = config.get('cache', 'cache_path')
+        self.cache_max_age = config.getint('cache', 'cache_max_age')
+        self.cache_zones_max_age = config.getint('cache', 'cache_zones_max_age')
         return config
 
     def get_inventory_options(self):
@@ -277,9 +770,9 @@ class GceInventory(object):
         ip_type = os.environ.get('INVENTORY_IP_TYPE', ip_type)
         return ip_type
 
-    def get_gce_driver(self):
-        """Determine the GCE authorization settings and return a
-        libcloud driver.
+    def get_gce_params(self):
+        """Determine the GCE authorization settings and return the
+        arguments of the libcloud driver.
         """
         # Attempt to get GCE params from a configuration file, if one
         # exists.
@@ -324,9 +817,23 @@ class GceInventory(object):
 
         kwargs['project'] = os.environ.get('GCE_PROJECT', kwargs['project'])
         kwargs['datacenter'] = os.environ.get('GCE_ZONE', kwargs['datacenter'])
+        return args, kwargs
 
-        # Retrieve and return the GCE driver.
-        gce = get_driver(Provider.GCE)(*args, **kwargs)
+    def get_gce_driver(self):
+        """Return a libcloud driver."""
+        args, kwargs = self.get_gce_params()
+
+        # Retrieve and return the GCE driver. GCE_LIBCLOUD_DRIVER names a
+        # python file providing a libcloud compatible GCENodeDriver instead,
+        # such as tests/files/fake_gce.py replaying instances offline.
+        driver_path = os.environ.get('GCE_LIBCLOUD_DRIVER')
+        if driver_path:
+            sys.path.append(os.path.dirname(os.path.abspath(driver_path)))
+            driver_module = os.path.splitext(os.path.basename(driver_path))[0]
+            driver_class = __import__(driver_module).GCENodeDriver
+        else:
+            driver_class = get_driver(Provider.GCE)
+        gce = driver_class(*args, **kwargs)
         gce.connection.user_agent_append(
             '%s/%s' % (USER_AGENT_PRODUCT, USER_AGENT_VERSION),
         )
@@ -335,28 +842,11 @@ class GceInventory(object):
     def parse_env_zones(self):
         '''returns a list of comma separated zones parsed from the GCE_ZONE environment variable.
         If provided, this will be used to filter the results of the grouped_instances call'''
-        import csv
-        reader = csv.reader([os.environ.get('GCE_ZONE', "")], skipinitialspace=True)
-        zones = [r for r in reader]
-        return [z for z in zones[0]]
+        return parse_zones(os.environ.get('GCE_ZONE', ""))
 
     def parse_cli_args(self):
         ''' Command line argument processing '''
-
-        parser = argparse.ArgumentParser(
-            description='Produce an Ansible Inventory file based on GCE')
-        parser.add_argument('--list', action='store_true', default=True,
-                            help='List instances (default: True)')
-        parser.add_argument('--host', action='store',
-                            help='Get all information about an instance')
-        parser.add_argument('--instance-tags', action='store',
-                            help='Only include instances with this tags, separated by comma')
-        parser.add_argument('--pretty', action='store_true', default=False,
-                            help='Pretty format (default: False)')
-        parser.add_argument(
-            '--refresh-cache', action='store_true', default=False,
-            help='Force refresh of cache by making API requests (default: False - use cache files)')
-        self.args = parser.parse_args()
+        self.args = cli_parser().parse_args()
 
     def node_to_dict(self, inst):
         md = {}
@@ -398,41 +888,203 @@ class GceInventory(object):
             'ansible_host': ssh_host
         }
 
-    def load_inventory_from_cache(self):
-        ''' Loads inventory from JSON on disk. '''
-
+    def zone_shard(self, zone):
+        return 'zone-%s' % zone
+
+    def index_name(self, zones):
+        ''' Name of the index of the inventory of zones, all zones by default '''
+        if not zones:
+            return 'inventory-all'
+        return 'inventory-%s' % hashlib.sha1(','.join(sorted(zones)).encode('utf-8')).hexdigest()[:12]
+
+    def update_inventory(self, zones, refresh=False):
+        ''' Loads the inventory of zones from the cache, one shard per zone,
+        and refreshes only the shards that expired.
+
+        Without zones, the zones are the ones of the previous full listing,
+        kept in the 'zones' shard. Once it expires, or with refresh, all
+        zones are listed again at once. With cache_max_age = 0 the cache is
+        neither read nor written, every run lists the zones again.
+
+        Returns the refreshed zones, whether the cache was used and the time
+        the oldest shard expires. '''
+        cached = self.cache_max_age > 0
+        if zones:
+            # A zone named twice would be merged with itself
+            requested = sorted(set(zones))
+        elif cached and not refresh and self.cache.is_valid('zones', self.cache_zones_max_age):
+            try:
+                requested = self.cache.get_all_data_from_cache('zones')
+            except (IOError, OSError, ValueError):
+                requested = None
+        else:
+            requested = None
+
+        now = time()
+        expires = [now + self.cache_max_age]
+        if requested is not None and not zones:
+            expires.append(os.path.getmtime(self.cache.shard_path('zones')) +
+                           self.cache_zones_max_age)
+
+        shards = {}
+        for zone in requested or []:
+            shard = self.zone_shard(zone)
+            if cached and not refresh and self.cache.is_valid(shard):
+                try:
+                    mtime = os.path.getmtime(self.cache.shard_path(shard))
+                    shards[zone] = self.cache.get_all_data_from_cache(shard)
+                    expires.append(mtime + self.cache_max_age)
+                except (IOError, OSError, ValueError):
+                    pass
+        cache_used = bool(shards)
+
+        full = requested is None
+        if full:
+            # All zones at once, with the aggregated listing
+            fetched = self.fetch_zones(None)
+            previous = []
+            try:
+                if cached:
+                    previous = self.cache.get_all_data_from_cache('zones')
+            except (IOError, OSError, ValueError):
+                pass
+            for zone in set(previous) - set(fetched):
+                self.cache.remove(self.zone_shard(zone))
+            requested = sorted(fetched)
+        else:
+            stale = [zone for zone in requested if zone not in shards]
+            fetched = self.fetch_zones(stale) if stale else {}
+
+        for zone, data in sorted(fetched.items()):
+            if cached:
+                self.cache.write_to_cache(data, self.zone_shard(zone))
+            shards[zone] = data
+        if full and cached:
+            self.cache.write_to_cache(requested, 'zones')
+
+        self.inventory = self.merge_inventories([shards[zone] for zone in requested])
+        return sorted(fetched), cache_used, min(expires)
+
+    def fetch_zones(self, zones):
+        ''' Lists the instances of zones, all zones with None, and groups
+        them by zone. Returns a dictionary of inventories keyed by zone. '''
+        nodes = dict((zone, []) for zone in zones or [])
+        for node in self.list_nodes(zones):
+            nodes.setdefault(node.extra['zone'].name, []).append(node)
+        return dict((zone, self.group_instances(nodes=zone_nodes))
+                    for zone, zone_nodes in nodes.items())
+
+    def merge_inventories(self, inventories):
+        ''' Merges the groups and host variables of several inventories
+        into the first one, which is returned. The others are consumed:
+        groups found in a single inventory are moved, not copied, and the
+        lists of the first are extended in place. '''
+        if not inventories:
+            return {'_meta': {'hostvars': {}}}
+        merged = inventories[0]
+        hostvars = merged.setdefault('_meta', {'hostvars': {}})['hostvars']
+        for inventory in inventories[1:]:
+            for group, hosts in inventory.items():
+                if group == '_meta':
+                    hostvars.update(hosts['hostvars'])
+                elif group not in merged:
+                    merged[group] = hosts
+                else:
+                    if isinstance(merged[group], tuple):
+                        # Address groups hold a single host
+                        merged[group] = list(merged[group])
+                    merged[group].extend(hosts)
+        return merged
+
+    def to_node(self, driver, instance):
+        ''' Converts an instance of the API to a libcloud Node, None when
+        it was deleted meanwhile '''
         try:
-            self.inventory = self.cache.get_all_data_from_cache()
-            hosts = self.inventory['_meta']['hostvars']
-        except Exception as e:
-            print(
-                "Invalid inventory file %s.  Please rebuild with -refresh-cache option."
-                % (self.cache.cache_path_cache))
-            raise
-
-    def do_api_calls_update_cache(self):
-        ''' Do API calls and save data in cache. '''
-        zones = self.parse_env_zones()
-        data = self.group_instances(zones)
-        self.cache.write_to_cache(data)
-        self.inventory = data
-
-    def list_nodes(self):
-        all_nodes = []
-        params, more_results = {'maxResults': 500}, True
-        while more_results:
-            self.driver.connection.gce_params = params
-            all_nodes.extend(self.driver.list_nodes())
-            more_results = 'pageToken' in params
-        return all_nodes
-
-    def group_instances(self, zones=None):
-        '''Group all instances'''
-        groups = {}
-        meta = {}
-        meta["hostvars"] = {}
-
-        for node in self.list_nodes():
+            if self.disk_cache:
+                return driver._to_node(instance, use_disk_cache=True)
+            return driver._to_node(instance)
+        except ResourceNotFoundError:
+            return None
+
+    def fetch_nodes(self, driver, path):
+        ''' Lists the instances of path, following nextPageToken until the
+        last page '''
+        nodes = []
+        params = {'maxResults': self.page_size}
+        while True:
+            response = driver.connection.request(path, method='GET', params=params).object
+            items = response.get('items', [])
+            if isinstance(items, dict):
+                # Aggregated list: {'zones/<zone>': {'instances': [...]}}
+                items = [instance for scope in items.values()
+                         for instance in scope.get('instances', [])]
+            for instance in items:
+                node = self.to_node(driver, instance)
+                if node is not None:
+                    nodes.append(node)
+            if not response.get('nextPageToken'):
+                return nodes
+            params['pageToken'] = response['nextPageToken']
+
+    def list_nodes(self, zones=None):
+        ''' Lists all instances with one aggregated, paginated request.
+        With zones, only those zones are listed, concurrently over at most
+        max_connections connections. '''
+        if self.driver is None:
+            self.driver = self.get_gce_driver()
+
+        # Disk details of every node come from one aggregated disk listing
+        # instead of one request per disk
+        self.disk_cache = hasattr(self.driver, '_ex_populate_volume_dict')
+        if self.disk_cache:
+            self.driver._ex_populate_volume_dict()
+
+        if not zones:
+            return self.fetch_nodes(self.driver, '/aggregated/instances')
+
+        pending = queue.Queue()
+        for zone in zones:
+            pending.put(zone)
+        results = {}
+        errors = []
+
+        def worker(index):
+            try:
+                # libcloud connections are not thread safe, every worker
+                # but the first one opens its own
+                driver = self.driver if index == 0 else self.get_gce_driver()
+                if self.disk_cache:
+                    driver._ex_volume_dict = self.driver._ex_volume_dict
+                while True:
+                    try:
+                        zone = pending.get_nowait()
+                    except queue.Empty:
+                        return
+                    results[zone] = self.fetch_nodes(driver, '/zones/%s/instances' % zone)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=worker, args=(index,))
+                   for index in range(max(1, min(self.max_connections, len(zones))))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+
+        return [node for zone in zones for node in results.get(zone, [])]
+
+    def group_instances(self, zones=None, nodes=None):
+        '''Group all instances, the ones of nodes when given'''
+        if nodes is None:
+            nodes = self.list_nodes(zones)
+        return self.group_nodes(self.filter_nodes(nodes), zones)
+
+    def filter_nodes(self, nodes):
+        '''Yields the nodes in the desired instance states, with the
+        desired instance tags'''
+        for node in nodes:
 
             # This check filters on the desired instance states defined in the
             # config file with the instance_states config option.
@@ -456,14 +1108,24 @@ class GceInventory(object):
             if self.instance_tags and not set(self.instance_tags) & set(node.extra['tags']):
                 continue
 
+            yield node
+
+    def group_nodes(self, nodes, zones=None):
+        '''Group nodes'''
+        groups = {}
+        meta = {}
+        meta["hostvars"] = {}
+
+        for node in nodes:
+
             name = node.name
 
             meta["hostvars"][name] = self.node_to_dict(node)
 
             zone = node.extra['zone'].name
 
-            # To avoid making multiple requests per zone
-            # we list all nodes and then filter the results
+            # Only the requested zones are listed, this only drops
+            # instances that moved zone while the listing was running
             if zones and zone not in zones:
                 continue
 
@@ -509,12 +1171,14 @@ class GceInventory(object):
             else:
                 groups[stat] = [name]
 
+            # One group per address, the most numerous ones: a tuple is
+            # smaller than a list and is encoded the same way
             for private_ip in node.private_ips:
-                groups[private_ip] = [name]
+                groups[private_ip] = (name,)
 
             if len(node.public_ips) >= 1:
                 for public_ip in node.public_ips:
-                    groups[public_ip] = [name]
+                    groups[public_ip] = (name,)
 
         groups["_meta"] = meta
 
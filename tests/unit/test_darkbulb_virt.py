@@ -0,0 +1,104 @@
+# (c) 2018, Victor da Costa <victorockeiro@gmail.com>
+#
+# This file is part of Ansible
+#
+# Ansible is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Ansible is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Ansible.  If not, see <http://www.gnu.org/licenses/>.
+'''
+Comparison of live libvirt definitions with rendered documents, and
+volume sizes.
+
+    python -m unittest discover -s tests/unit -t tests
+'''
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import os
+import unittest
+
+import yaml
+
+from xml.etree import ElementTree
+
+from unit import ROOT, load
+
+darkbulb_virt = load('darkbulb_virt', 'module_utils/darkbulb_virt.py')
+xml_filters = load('darkbulb_xml', 'filter_plugins/xml.py')
+
+
+def load_topology():
+    with open(os.path.join(ROOT, 'vars', 'main.yml')) as f:
+        return yaml.safe_load(f)['__darkbulb_topology']
+
+
+def load_dumpxml():
+    '''virsh dumpxml --inactive of leaf01 on a QEMU host without graphics'''
+    with open(os.path.join(ROOT, 'tests', 'files', 'leaf01-dumpxml.xml')) as f:
+        return f.read()
+
+
+class TestSameDefinition(unittest.TestCase):
+
+    def setUp(self):
+        self.desired = xml_filters.to_xml(load_topology()['domains']['leaf01'])
+        self.live = ElementTree.fromstring(load_dumpxml())
+
+    def live_xml(self):
+        return ElementTree.tostring(self.live)
+
+    def test_dumpxml_matches_rendered_document(self):
+        self.assertTrue(darkbulb_virt.same_definition(self.live_xml(), self.desired))
+
+    def test_default_devices_are_ignored(self):
+        devices = self.live.find('devices')
+        for tag in ('audio', 'video', 'rng', 'watchdog'):
+            self.assertIsNotNone(devices.find(tag), tag)
+        for extra in ("<audio id='2' type='none'/>", "<video><model type='vga'/></video>"):
+            devices.append(ElementTree.fromstring(extra))
+        self.assertTrue(darkbulb_virt.same_definition(self.live_xml(), self.desired))
+
+    def test_changed_link_is_a_difference(self):
+        local = self.live.find("devices/interface[@type='udp']/source/local")
+        local.set('port', '29999')
+        self.assertFalse(darkbulb_virt.same_definition(self.live_xml(), self.desired))
+
+    def test_changed_memory_is_a_difference(self):
+        self.live.find('memory').text = '2097152'
+        self.assertFalse(darkbulb_virt.same_definition(self.live_xml(), self.desired))
+
+    def test_generated_tag_is_compared_when_desired(self):
+        topology = load_topology()
+        domain = topology['domains']['leaf01']
+        domain['domain']['devices']['watchdog'] = {'@model': 'i6300esb', '@action': 'reset'}
+        desired = xml_filters.to_xml(domain)
+        self.assertFalse(darkbulb_virt.same_definition(self.live_xml(), desired))
+
+
+class TestQemuImgCreate(unittest.TestCase):
+
+    def volume(self, unit):
+        return "<volume><name>leaf01</name><capacity unit='%s'>4</capacity></volume>" % unit
+
+    def test_byte_units(self):
+        for unit in ('B', 'bytes', 'GiB'):
+            darkbulb_virt.qemu_img_create('/nonexistent/leaf01', self.volume(unit), qemu_img='true')
+
+    def test_unknown_unit(self):
+        with self.assertRaisesRegex(Exception, 'Unknown capacity unit parsec of volume leaf01'):
+            darkbulb_virt.qemu_img_create('/nonexistent/leaf01', self.volume('parsec'),
+                                          qemu_img='true')
+
+
+if __name__ == '__main__':
+    unittest.main()
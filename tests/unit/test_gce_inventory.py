@@ -0,0 +1,130 @@
+# (c) 2018, Victor da Costa <victorockeiro@gmail.com>
+#
+# This file is part of Ansible
+#
+# Ansible is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Ansible is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Ansible.  If not, see <http://www.gnu.org/licenses/>.
+'''
+Zone shards of the GCE inventory: cache and merge.
+
+    python -m unittest discover -s tests/unit -t tests
+'''
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from unit import load
+
+gce = load('gce_inventory', 'tests/inventory/gce.py')
+
+
+def shard(zone, *names):
+    inventory = {
+        '_meta': {'hostvars': dict((name, {'gce_zone': zone}) for name in names)},
+        zone: list(names),
+        'tag_web': list(names),
+    }
+    for index, name in enumerate(names):
+        inventory['10.0.%d.%d' % (len(zone), index)] = (name,)
+    return inventory
+
+
+class TestMergeInventories(unittest.TestCase):
+
+    def setUp(self):
+        # merge_inventories does not depend on the configuration
+        self.inventory = gce.GceInventory.__new__(gce.GceInventory)
+
+    def test_groups_and_hostvars_are_merged(self):
+        merged = self.inventory.merge_inventories([shard('europe-west1-b', 'a', 'b'),
+                                                   shard('us-east1-c', 'c')])
+        self.assertEqual(merged['tag_web'], ['a', 'b', 'c'])
+        self.assertEqual(merged['us-east1-c'], ['c'])
+        self.assertEqual(sorted(merged['_meta']['hostvars']), ['a', 'b', 'c'])
+        self.assertEqual(merged['10.0.14.1'], ('b',))
+        json.loads(''.join(gce.json_chunks(merged)))
+
+    def test_groups_are_not_copied(self):
+        first, second = shard('europe-west1-b', 'a'), shard('us-east1-c', 'c')
+        web, zone = first['tag_web'], second['us-east1-c']
+        merged = self.inventory.merge_inventories([first, second])
+        self.assertIs(merged, first)
+        self.assertIs(merged['tag_web'], web)
+        self.assertIs(merged['us-east1-c'], zone)
+
+    def test_shared_address_group_is_extended(self):
+        first, second = shard('europe-west1-b', 'a'), shard('us-east1-c', 'c')
+        second['10.0.14.0'] = ('c',)
+        merged = self.inventory.merge_inventories([first, second])
+        self.assertEqual(merged['10.0.14.0'], ['a', 'c'])
+
+    def test_no_inventory(self):
+        self.assertEqual(self.inventory.merge_inventories([]), {'_meta': {'hostvars': {}}})
+
+
+class TestUpdateInventory(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+        self.live = {'europe-west1-b': ['a', 'b'], 'us-east1-c': ['c']}
+        self.fetched = []
+
+    def fetch_zones(self, zones):
+        # Stands for the API, zones of None is the aggregated listing
+        self.fetched.append(zones)
+        return dict((zone, shard(zone, *self.live[zone])) for zone in zones or self.live)
+
+    def run_inventory(self, zones, cache_max_age):
+        inventory = gce.GceInventory.__new__(gce.GceInventory)
+        inventory.cache_max_age = cache_max_age
+        inventory.cache_zones_max_age = 3600
+        inventory.cache = gce.CloudInventoryCache(cache_path=self.path,
+                                                  cache_max_age=cache_max_age)
+        inventory.fetch_zones = self.fetch_zones
+        refreshed, cache_used, dummy = inventory.update_inventory(zones)
+        return inventory.inventory, refreshed, cache_used
+
+    def test_disabled_cache_sees_new_zones(self):
+        self.run_inventory(None, 0)
+        self.live['asia-east1-a'] = ['d']
+        merged, refreshed, cache_used = self.run_inventory(None, 0)
+        self.assertEqual(refreshed, ['asia-east1-a', 'europe-west1-b', 'us-east1-c'])
+        self.assertEqual(sorted(merged['_meta']['hostvars']), ['a', 'b', 'c', 'd'])
+        self.assertFalse(cache_used)
+        self.assertEqual(self.fetched, [None, None])
+        self.assertEqual(os.listdir(os.path.join(self.path, 'ansible-cloud-cache')), [])
+
+    def test_cached_zones_are_reused(self):
+        self.run_inventory(None, 300)
+        self.live['asia-east1-a'] = ['d']
+        merged, refreshed, cache_used = self.run_inventory(None, 300)
+        self.assertEqual(refreshed, [])
+        self.assertTrue(cache_used)
+        self.assertEqual(sorted(merged['_meta']['hostvars']), ['a', 'b', 'c'])
+
+    def test_zone_named_twice(self):
+        for cache_max_age in (0, 300, 300):
+            merged, dummy, dummy = self.run_inventory(['us-east1-c', 'us-east1-c'], cache_max_age)
+            self.assertEqual(merged['tag_web'], ['c'])
+            self.assertEqual(list(merged['10.0.10.0']), ['c'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+# (c) 2018, Victor da Costa <victorockeiro@gmail.com>
+#
+# This file is part of Ansible
+#
+# Ansible is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Ansible is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Ansible.  If not, see <http://www.gnu.org/licenses/>.
+'''
+Render cache of the to_xml and topology_to_xml filters.
+
+    python -m unittest discover -s tests/unit -t tests
+'''
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import os
+import unittest
+
+import yaml
+
+from unit import ROOT, load
+
+xml_filters = load('darkbulb_xml', 'filter_plugins/xml.py')
+
+
+def load_topology():
+    with open(os.path.join(ROOT, 'vars', 'main.yml')) as f:
+        return yaml.safe_load(f)['__darkbulb_topology']
+
+
+class TestRenderCache(unittest.TestCase):
+
+    def setUp(self):
+        self.topology = load_topology()
+        self.cache = xml_filters._RENDER_CACHE
+        self.addCleanup(setattr, self.cache, 'maxsize', self.cache.maxsize)
+        self.cache.clear()
+
+    def count_keys(self):
+        '''Count the cache keys built from now on'''
+        calls = []
+        render_key = xml_filters._render_key
+
+        def counted(*args):
+            calls.append(args)
+            return render_key(*args)
+        xml_filters._render_key = counted
+        self.addCleanup(setattr, xml_filters, '_render_key', render_key)
+        return calls
+
+    def test_repeated_render_is_a_hit(self):
+        domain = self.topology['domains']['leaf01']
+        first = xml_filters.to_xml(domain)
+        self.assertEqual(xml_filters.to_xml(domain), first)
+        info = xml_filters.to_xml_cache_info()
+        self.assertEqual((info['hits'], info['misses'], info['size']), (1, 1, 1))
+
+    def test_disabled_cache_builds_no_key(self):
+        self.cache.maxsize = 0
+        calls = self.count_keys()
+        domain = self.topology['domains']['leaf01']
+        self.assertEqual(xml_filters.to_xml(domain), xml_filters.to_xml(domain))
+        documents = xml_filters.topology_to_xml(self.topology, processes=1)
+        self.assertEqual(len(documents['domains']), len(self.topology['domains']))
+        self.assertEqual(calls, [])
+        info = xml_filters.to_xml_cache_info()
+        self.assertEqual((info['hits'], info['misses'], info['size']), (0, 0, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()